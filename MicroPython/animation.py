@@ -0,0 +1,135 @@
+# Sprite animation for Cya's head display
+# Plays the frames of a .565 file (see tools/img2rgb565.py) on a st7735.TFT
+# without blocking the rest of the program. Call tick() from the main loop,
+# or run play() as a uasyncio task.
+#
+# Only the rectangle that differs between one frame and the next is sent
+# to the display, so animations such as blinking eyes cost a small fraction
+# of a full redraw.
+
+import utime
+import st7735
+from array import array
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+@micropython.native
+def _rowdiff(a, b, start, n):
+    """ Compare n bytes of a and b from start. Returns the byte offsets of the
+    first and last differing pixels, or (-1, -1) if they are the same. """
+    first = -1
+    last = -1
+    for i in range(start, start + n, 2):
+        if a[i] != b[i] or a[i + 1] != b[i + 1]:
+            if first < 0:
+                first = i - start
+            last = i - start
+    return first, last
+
+
+class Animation:
+    """ A sequence of equally sized frames drawn at (x, y) on tft. frames is a
+    list of buffers of big endian 565 pixels, width x height each. """
+    def __init__(self, tft, frames, width, height, x=0, y=0, fps=10, loop=True):
+        self.tft = tft
+        self.frames = frames
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.loop = loop
+        self.frame = 0
+        self.playing = False
+        self.fps(fps)
+        self._due = 0
+        # Changed rectangle x0, y0, x1, y1 (exclusive) going into each frame
+        self._delta = array('h', [0] * (4 * len(frames)))
+        for i in range(len(frames)):
+            self._diff(frames[i - 1], frames[i], 4 * i)
+
+    @classmethod
+    def load(cls, tft, filename, x=0, y=0, fps=10, loop=True):
+        """ Load all the frames of a .565 file. """
+        width, height, frames = st7735.load565(filename)
+        return cls(tft, frames, width, height, x, y, fps, loop)
+
+    def fps(self, fps):
+        """ Set the playback rate in frames per second. """
+        self._period = 1000 // fps
+
+    def start(self, frame=0):
+        """ Draw frame in full and start playing from it. """
+        self.frame = frame
+        self.tft.image(self.x, self.y, self.x + self.width - 1,
+                       self.y + self.height - 1, self.frames[frame])
+        self._due = utime.ticks_add(utime.ticks_ms(), self._period)
+        self.playing = True
+
+    def stop(self):
+        self.playing = False
+
+    def tick(self):
+        """ Draw the next frame if it is due. Returns True if anything was
+        drawn, so a buffered display knows it needs a show(). """
+        if not self.playing:
+            return False
+        now = utime.ticks_ms()
+        late = utime.ticks_diff(now, self._due)
+        if late < 0:
+            return False
+        nxt = self.frame + 1
+        if nxt == len(self.frames):
+            if not self.loop:
+                self.playing = False
+                return False
+            nxt = 0
+        self.frame = nxt
+        d = self._delta
+        i = 4 * nxt
+        if d[i + 2] > d[i]:
+            self.tft.subimage(self.x + d[i], self.y + d[i + 1], self.frames[nxt],
+                              self.width, d[i], d[i + 1],
+                              d[i + 2] - d[i], d[i + 3] - d[i + 1])
+        if late >= self._period:
+            # Fell behind. Drop the lost time rather than rushing to catch up.
+            self._due = utime.ticks_add(now, self._period)
+        else:
+            self._due = utime.ticks_add(self._due, self._period)
+        return True
+
+    async def play(self, frame=0):
+        """ Play until stopped (or the end, if not looping) as a uasyncio task. """
+        self.start(frame)
+        while self.playing:
+            wait = utime.ticks_diff(self._due, utime.ticks_ms())
+            await asyncio.sleep(max(wait, 0) / 1000)
+            self.tick()
+
+    def _diff(self, a, b, i):
+        """ Store the bounding box of the pixels that differ between frames
+        a and b at self._delta[i]. """
+        stride = self.width * 2
+        x0 = self.width
+        x1 = 0
+        y0 = -1
+        y1 = 0
+        for row in range(self.height):
+            first, last = _rowdiff(a, b, row * stride, stride)
+            if first >= 0:
+                if y0 < 0:
+                    y0 = row
+                y1 = row + 1
+                x0 = min(x0, first // 2)
+                x1 = max(x1, last // 2 + 1)
+        d = self._delta
+        if y0 < 0:
+            d[i] = d[i + 1] = d[i + 2] = d[i + 3] = 0
+        else:
+            d[i] = x0
+            d[i + 1] = y0
+            d[i + 2] = x1
+            d[i + 3] = y1
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# Bus traffic benchmarks for the Cya drivers, run on a PC.
+#
+# Each workload drives st7735.py, mpu6050.py or joints.py against the
+# simulated devices in devices.py and reports the SPI and I2C transactions,
+# payload bytes and modelled bus time it took. The numbers are exact and
+# repeatable, so they can be saved and compared to catch a change that
+# makes a driver slower:
+#
+#   python bench.py                       # show the results
+#   python bench.py --save base.json      # keep them
+#   python bench.py --compare base.json   # exit 1 if anything got worse
+#   python bench.py --only tft            # just the workloads named tft*
+#
+# Bus time is modelled from the clocks given with --spi-hz and --i2c-hz
+# plus a fixed cost per transaction (--spi-overhead-us, --i2c-overhead-us).
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import shim
+shim.install()
+
+import machine     # noqa: E402
+import utime       # noqa: E402
+import devices     # noqa: E402
+
+_DC = 17
+_CS = 16
+_INT = 19          # MPU6050 INT
+
+WORKLOADS = []
+
+
+def workload(func):
+    WORKLOADS.append((func.__name__, func))
+    return func
+
+
+class Env:
+    """ What a workload needs: the bus clocks, a scratch directory and
+    begin(), which starts the measurement once setup is done. """
+    def __init__(self, args, tmpdir):
+        self.spi_hz = args.spi_hz
+        self.i2c_hz = args.i2c_hz
+        self.tmpdir = tmpdir
+        self.started = False
+
+    def begin(self):
+        machine.reset_stats()
+        self.started = True
+
+    def tft(self, buffered=False):
+        import st7735
+        spi = machine.SPI(2, baudrate=self.spi_hz)
+        panel = devices.ST7735(_DC)
+        spi.attach(panel)
+        tft = st7735.TFT(spi, _DC, aCS=_CS)
+        tft.init_7735(tft.GREENTAB128x128)
+        if buffered:
+            tft.buffered()
+        return tft
+
+    def i2c(self):
+        return machine.I2C(0, scl=machine.Pin(22), sda=machine.Pin(21), freq=self.i2c_hz)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+
+def _font():
+    from sysfont import sysfont
+    return sysfont
+
+
+def _text_screen(tft, bg=None):
+    font = _font()
+    line = 'The quick brown fox 0'
+    for row in range(16):
+        tft.text((0, row * 8), line, tft.WHITE, font, 1, True, bg)
+
+
+@workload
+def tft_fill(env):
+    tft = env.tft()
+    env.begin()
+    tft.fill(tft.BLUE)
+
+
+@workload
+def tft_text(env):
+    tft = env.tft()
+    tft.fill(tft.BLACK)
+    env.begin()
+    _text_screen(tft)
+
+
+@workload
+def tft_text_opaque(env):
+    tft = env.tft()
+    env.begin()
+    _text_screen(tft, tft.BLACK)
+
+
+@workload
+def tft_text_buffered(env):
+    tft = env.tft(buffered=True)
+    tft.fill(tft.BLACK)
+    tft.show()
+    env.begin()
+    _text_screen(tft)
+    tft.show()
+
+
+@workload
+def tft_shapes(env):
+    tft = env.tft()
+    env.begin()
+    for r in range(4, 64, 6):
+        tft.circle((64, 64), r, tft.GREEN)
+    tft.fillcircle((64, 64), 20, tft.RED)
+    for x in range(0, 128, 8):
+        tft.line((x, 0), (127 - x, 127), tft.YELLOW)
+
+
+def _write_bmp(path, width, height):
+    rowsize = (width * 3 + 3) & ~3
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<2sIHHI', b'BM', 54 + rowsize * height, 0, 0, 54))
+        f.write(struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0,
+                            rowsize * height, 2835, 2835, 0, 0))
+        for y in range(height):
+            row = bytearray()
+            for x in range(width):
+                row += bytes((x * 2 & 0xff, y * 2 & 0xff, (x + y) & 0xff))
+            f.write(row + bytes(rowsize - width * 3))
+
+
+@workload
+def tft_bmp(env):
+    tft = env.tft()
+    path = env.path('bench.bmp')
+    _write_bmp(path, 128, 128)
+    env.begin()
+    tft.load_bmp(path)
+
+
+def _eye_frames(size=32, count=4):
+    """ A blinking eye: a white disc with a lid coming down. """
+    frames = []
+    for n in range(count):
+        lid = n * size // (count - 1) // 2
+        rows = []
+        for y in range(size):
+            row = []
+            for x in range(size):
+                inside = (x - size // 2) ** 2 + (y - size // 2) ** 2 < (size // 2 - 2) ** 2
+                row.append((255, 255, 255) if inside and y >= lid else (0, 0, 96))
+            rows.append(row)
+        frames.append(rows)
+    return frames
+
+
+def _write_565(path, frames, rle):
+    sys.path.insert(0, os.path.join(shim.DRIVER_DIR, 'tools'))
+    import img2rgb565
+    size = len(frames[0])
+    with open(path, 'wb') as f:
+        f.write(img2rgb565.encode(frames, size, size, rle))
+
+
+@workload
+def tft_blit565(env):
+    tft = env.tft()
+    path = env.path('bench.565')
+    frame = []
+    for y in range(128):
+        frame.append([(0, 0, 96) if (x // 32 + y // 32) % 2 else (255, 200, 0)
+                      for x in range(128)])
+    _write_565(path, [frame], True)
+    env.begin()
+    tft.blit_file(path)
+
+
+@workload
+def tft_animation(env):
+    import animation
+    tft = env.tft()
+    path = env.path('eye.565')
+    _write_565(path, _eye_frames(), True)
+    anim = animation.Animation.load(tft, path, 48, 48, fps=10)
+    env.begin()
+    anim.start()
+    end = utime.now_us() + 2000000
+    while utime.now_us() < end:
+        if not anim.tick():
+            utime.sleep_ms(1)
+
+
+def _mpu(env, **kwargs):
+    import mpu6050
+    machine.I2C.attach(0x68, devices.MPU6050(**kwargs))
+    mpu = mpu6050.MPU6050(env.i2c())
+    mpu.wake
+    return mpu
+
+
+@workload
+def imu_sample(env):
+    mpu = _mpu(env)
+    env.begin()
+    for i in range(200):
+        mpu.acceleration
+        mpu.gyro
+        mpu.temperature
+
+
+@workload
+def imu_read_into(env):
+    from array import array
+    mpu = _mpu(env)
+    buf = array('f', [0] * 7)
+    env.begin()
+    for i in range(200):
+        mpu.read_into(buf)
+
+
+@workload
+def imu_fifo(env):
+    import mpu6050
+    mpu = _mpu(env)
+    mpu.sample_rate(1000)
+    mpu.fifo_enable(mpu6050.FIFO_ACCEL | mpu6050.FIFO_GYRO, frames=32)
+    env.begin()
+    # One second of samples, drained every 20ms
+    for i in range(50):
+        utime.sleep_ms(20)
+        mpu.read_fifo()
+
+
+@workload
+def imu_irq(env):
+    import mpu6050
+    from array import array
+    mpu = _mpu(env)
+    chip = machine.I2C._devices[0x68]
+    mpu.sample_rate(500)
+    mpu.irq_start(machine.Pin(_INT, machine.Pin.IN), mpu6050.SampleRing(64))
+    sample = array('h', [0] * 7)
+    env.begin()
+    # One second of samples, emptying the ring every 50
+    for i in range(500):
+        chip.step(_INT)
+        if i % 50 == 49:
+            while mpu.ring.get(sample) is not None:
+                pass
+    mpu.irq_stop()
+
+
+@workload
+def imu_aux(env):
+    from array import array
+    # A magnetometer (HMC5883L registers) on the auxiliary bus
+    mag = devices.Registers({0x03: 0x01, 0x04: 0x2c, 0x05: 0xff, 0x06: 0x10, 0x07: 0x00, 0x08: 0x80})
+    mpu = _mpu(env, aux={0x1e: mag})
+    mpu.aux_enable()
+    mpu.aux_write(0x1e, 0x02, 0x00)     # Continuous measurement
+    mpu.aux_slot(0, 0x1e, 0x03, 6)
+    buf = array('h', [0] * 7)
+    env.begin()
+    # Accel, gyro and magnetometer together
+    for i in range(200):
+        utime.sleep_us(mpu.sample_period_us)
+        mpu.read_raw_into(buf)
+
+
+def _joints(env, noise=0):
+    import joints
+    pca = devices.PCA9685()
+    machine.I2C.attach(0x40, pca)
+    machine.ADC.source = devices.JointSensors(pca, noise=noise)
+    return joints.JOINTS(env.i2c())
+
+
+@workload
+def joint_sweep(env):
+    import joints
+    j = _joints(env)
+    env.begin()
+    for sweep in range(10):
+        for joint in range(6):
+            j.speed(joint, 1024 + 256 * sweep, joints.FORWARD)
+        for joint in range(6):
+            j.sensor(joint)
+    for joint in range(6):
+        j.speed(joint, 0, joints.COAST)
+
+
+@workload
+def joint_set_all(env):
+    # joint_sweep's motor commands, given through set_all()
+    import joints
+    j = _joints(env)
+    env.begin()
+    for sweep in range(10):
+        j.set_all([1024 + 256 * sweep] * 6, [joints.FORWARD] * 6)
+        for joint in range(6):
+            j.sensor(joint)
+    j.set_all([0] * 6, [joints.COAST] * 6)
+
+
+@workload
+def joint_read_all(env):
+    # joint_sweep with the sensors read by read_all_sensors()
+    import joints
+    j = _joints(env)
+    env.begin()
+    for sweep in range(10):
+        for joint in range(6):
+            j.speed(joint, 1024 + 256 * sweep, joints.FORWARD)
+        j.read_all_sensors()
+    for joint in range(6):
+        j.speed(joint, 0, joints.COAST)
+
+
+@workload
+def joint_calibrate(env):
+    # Find the ends of every joint, then read the angles
+    import array
+    j = _joints(env, noise=3)
+    env.begin()
+    for joint in range(6):
+        j.calibrate(joint, 180)
+    angles = array.array('h', [0] * 6)
+    for i in range(10):
+        j.angles_into(angles)
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, func in WORKLOADS:
+            if args.only and not any(name.startswith(o) for o in args.only):
+                continue
+            machine.I2C.detach_all()
+            machine.ADC.source = staticmethod(lambda pin: 0)
+            env = Env(args, tmpdir)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                func(env)
+            wall = time.perf_counter() - start
+            if not env.started:
+                raise RuntimeError("workload %s never called begin()" % name)
+            result = machine.stats()
+            result['bus_us'] = round(result['spi']['time_us'] + result['i2c']['time_us'], 1)
+            result['host_s'] = round(wall, 3)
+            results[name] = result
+    return results
+
+
+def report(results):
+    print("%-20s %8s %9s %10s %8s %9s %10s %11s"
+          % ('workload', 'spi tx', 'spi B', 'spi ms', 'i2c tx', 'i2c B', 'i2c ms', 'bus ms'))
+    for name, r in results.items():
+        spi, i2c = r['spi'], r['i2c']
+        print("%-20s %8d %9d %10.2f %8d %9d %10.2f %11.2f"
+              % (name, spi['transactions'], spi['bytes'], spi['time_us'] / 1000,
+                 i2c['transactions'], i2c['bytes'], i2c['time_us'] / 1000,
+                 r['bus_us'] / 1000))
+
+
+def _totals(r):
+    return {'transactions': r['spi']['transactions'] + r['i2c']['transactions'],
+            'bytes': r['spi']['bytes'] + r['i2c']['bytes'],
+            'bus_us': r['bus_us']}
+
+
+def compare(results, baseline, tolerance):
+    """ Print how each workload moved against baseline. Returns the number
+    of figures that got worse by more than tolerance (a fraction). """
+    regressions = 0
+    print()
+    print("%-20s %-14s %12s %12s %9s" % ('workload', 'figure', 'baseline', 'now', 'change'))
+    for name, r in results.items():
+        if name not in baseline:
+            print("%-20s (new)" % name)
+            continue
+        old = _totals(baseline[name])
+        new = _totals(r)
+        for key in ('transactions', 'bytes', 'bus_us'):
+            change = (new[key] - old[key]) / old[key] if old[key] else float(new[key] > 0)
+            worse = change > tolerance
+            regressions += worse
+            print("%-20s %-14s %12s %12s %+8.1f%%%s"
+                  % (name, key, old[key], new[key], 100 * change, '  WORSE' if worse else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bus traffic benchmarks for the Cya drivers.")
+    parser.add_argument('--spi-hz', type=int, default=20000000, help="SPI clock (default 20MHz)")
+    parser.add_argument('--i2c-hz', type=int, default=400000, help="I2C clock (default 400kHz)")
+    parser.add_argument('--spi-overhead-us', type=float, default=machine.SPI_OVERHEAD_US,
+                        help="fixed cost of each SPI transaction")
+    parser.add_argument('--i2c-overhead-us', type=float, default=machine.I2C_OVERHEAD_US,
+                        help="fixed cost of each I2C transaction")
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="run the workloads starting with NAME")
+    parser.add_argument('--list', action='store_true', help="list the workloads")
+    parser.add_argument('--save', metavar='FILE', help="save the results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="compare with results saved earlier")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="allowed fractional increase before --compare fails (default 0)")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, func in WORKLOADS:
+            print(name)
+        return 0
+    machine.SPI_OVERHEAD_US = args.spi_overhead_us
+    machine.I2C_OVERHEAD_US = args.i2c_overhead_us
+
+    results = run(args)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# Simulated devices for the host harness.
+#
+# MPU6050 and PCA9685 are register models that plug into machine.I2C with
+# I2C.attach(address, device). ST7735 listens to an SPI object (spi.attach)
+# and keeps the picture the driver has drawn. JointSensors stands in for
+# the joint position pots and the analog mux in front of ADC pin 36; set
+# it as machine.ADC.source.
+#
+# The models only go as far as the drivers need. They are for measuring
+# bus traffic and checking results, not for validating against datasheets.
+
+import ustruct
+import utime
+from machine import Pin
+
+
+class _Noise:
+    """ Small repeatable pseudo random noise, so runs can be compared. """
+    def __init__(self, seed=1):
+        self.state = seed
+
+    def __call__(self, amplitude):
+        if not amplitude:
+            return 0
+        self.state = (self.state * 1103515245 + 12345) & 0x7FFFFFFF
+        return (self.state >> 8) % (2 * amplitude + 1) - amplitude
+
+
+def still(t):
+    """ Default MPU6050 motion: Cya sitting still and level, in g, degrees C
+    and degrees per second. """
+    return (0.0, 0.0, 1.0, 25.0, 0.0, 0.0, 0.0)
+
+
+class MPU6050:
+    """ Register model of an MPU6050. motion(t) gives the true
+    (ax, ay, az, temp, gx, gy, gz) at t seconds; the data registers follow
+    it at the configured sample rate, with some noise and a fixed gyro bias
+    (in counts at 250dps).
+    The FIFO is filled with every sample while it is enabled. aux maps
+    addresses to devices on the auxiliary I2C bus, which the I2C master
+    reads into EXT_SENS_DATA each sample. """
+    def __init__(self, motion=still, noise=4, gyro_bias=(12, -7, 3), aux=None):
+        self.motion = motion
+        self.noise = noise
+        self.gyro_bias = gyro_bias
+        self.aux = aux or {}
+        self._rand = _Noise()
+        self.reset()
+
+    def reset(self):
+        self.regs = bytearray(128)
+        self.regs[0x6b] = 0x40      # PWR_MGMT_1: asleep
+        self.regs[0x75] = 0x68      # WHO_AM_I
+        self.fifo = bytearray()
+        self._sample = -1
+
+    def sample_rate(self):
+        """ Output data rate in Hz from CONFIG and SMPLRT_DIV. """
+        dlpf = self.regs[0x1a] & 0x07
+        gyro_rate = 8000 if dlpf in (0, 7) else 1000
+        return gyro_rate / (1 + self.regs[0x19])
+
+    def _sample_at(self, t):
+        ax, ay, az, temp, gx, gy, gz = self.motion(t)
+        accel_so = 16384 >> ((self.regs[0x1c] >> 3) & 3)
+        gyro_so = 131.0 / (1 << ((self.regs[0x1b] >> 3) & 3))
+        raw = [a * accel_so + self._rand(self.noise) for a in (ax, ay, az)]
+        raw.append((temp - 36.53) * 340)
+        raw += [(g + b / 131.0) * gyro_so + self._rand(self.noise)
+                for g, b in zip((gx, gy, gz), self.gyro_bias)]
+        return [max(-32768, min(32767, int(v))) for v in raw]
+
+    def _index(self):
+        return int(utime.now_us() * self.sample_rate() / 1000000)
+
+    def _fifo_on(self):
+        return self.regs[0x6a] & 0x40 and self.regs[0x23]
+
+    def _push(self, values):
+        sources = self.regs[0x23]
+        frame = bytearray()
+        if sources & 0x08:
+            frame += ustruct.pack('>3h', *values[0:3])
+        for bit, i in ((0x80, 3), (0x40, 4), (0x20, 5), (0x10, 6)):
+            if sources & bit:
+                frame += ustruct.pack('>h', values[i])
+        self.fifo += frame
+        if len(self.fifo) > 1024:
+            # Full: the oldest bytes are lost, which leaves the frames misaligned.
+            del self.fifo[:len(self.fifo) - 1024]
+            self.regs[0x3a] |= 0x10     # FIFO_OFLOW
+
+    def _update(self):
+        if self.regs[0x6b] & 0x40:
+            return
+        index = self._index()
+        if index == self._sample:
+            return
+        first = index
+        if self._fifo_on():
+            first = max(self._sample + 1, index - 1024)
+        for i in range(first, index + 1):
+            values = self._sample_at(i / self.sample_rate())
+            if self._fifo_on():
+                self._push(values)
+        self._sample = index
+        ustruct.pack_into('>7h', self.regs, 0x3b, *values)
+        self._aux_sample()
+        self.regs[0x3a] |= 0x01     # DATA_RDY
+
+    def _aux_sample(self):
+        if not self.regs[0x6a] & 0x20:  # I2C_MST_EN
+            return
+        ext = 0x49
+        for slot in range(4):
+            addr, reg, ctrl = self.regs[0x25 + 3 * slot:0x28 + 3 * slot]
+            if ctrl & 0x80 and addr & 0x80:
+                n = ctrl & 0x0f
+                device = self.aux.get(addr & 0x7f)
+                data = bytearray(device.read(reg, n) if device else bytes(n))
+                if ctrl & 0x40:         # BYTE_SW
+                    for i in range(0, n - 1, 2):
+                        data[i], data[i + 1] = data[i + 1], data[i]
+                self.regs[ext:ext + n] = data
+                ext += n
+
+    def _slv4(self):
+        """ Do the SLV4 single byte transfer just started. """
+        addr, reg, do, ctrl = self.regs[0x31:0x35]
+        self.regs[0x34] = ctrl & ~0x80
+        if not self.regs[0x6a] & 0x20:
+            return                      # Master off: never finishes
+        device = self.aux.get(addr & 0x7f)
+        if device is None:
+            self.regs[0x36] |= 0x10     # SLV4_NACK
+            return
+        if addr & 0x80:
+            self.regs[0x35] = device.read(reg, 1)[0]
+        else:
+            device.write(reg, bytes([do]))
+        self.regs[0x36] |= 0x40         # SLV4_DONE
+
+    def step(self, int_pin=None):
+        """ Move the clock on to the next sample. If one of the interrupts
+        enabled in INT_ENABLE is flagged, pulse the irq of int_pin. """
+        rate = self.sample_rate()
+        due = (self._index() + 1) * 1000000 / rate + 0.01
+        utime.advance(max(0, due - utime.now_us()))
+        self._update()
+        if int_pin is not None and self.regs[0x38] & self.regs[0x3a]:
+            Pin.fire(int_pin)
+
+    def read(self, reg, n):
+        self._update()
+        if reg == 0x74:
+            # FIFO_R_W does not auto increment, each byte comes from the FIFO
+            data = bytes(self.fifo[:n]) + bytes(max(0, n - len(self.fifo)))
+            del self.fifo[:n]
+            return data
+        ustruct.pack_into('>H', self.regs, 0x72, len(self.fifo))
+        data = bytes(self.regs[reg:reg + n])
+        if reg <= 0x3a < reg + n:
+            self.regs[0x3a] = 0     # INT_STATUS clears on read
+        if reg <= 0x36 < reg + n:
+            self.regs[0x36] = 0     # So does I2C_MST_STATUS
+        return data
+
+    def write(self, reg, data):
+        self._update()
+        for b in data:
+            if reg == 0x6b and b & 0x80:
+                self.reset()
+                return
+            if reg == 0x6a and b & 0x04:
+                self.fifo = bytearray()
+                b &= ~0x04
+            self.regs[reg] = b
+            if reg == 0x34 and b & 0x80:
+                self._slv4()
+            reg += 1
+        # Start counting samples afresh from now at the new rate
+        self._sample = self._index()
+
+
+class Registers:
+    """ A plain I2C device: 256 registers with auto increment, for example
+    a magnetometer on the MPU6050's auxiliary bus. """
+    def __init__(self, values=None):
+        self.regs = bytearray(256)
+        for reg, value in (values or {}).items():
+            self.regs[reg] = value
+
+    def read(self, reg, n):
+        return bytes(self.regs[reg:reg + n])
+
+    def write(self, reg, data):
+        self.regs[reg:reg + len(data)] = data
+
+
+class PCA9685:
+    """ Register model of a PCA9685. Multi byte transfers only step through
+    the registers when MODE1 auto increment is set, as on the real chip. """
+    def __init__(self):
+        self.regs = bytearray(256)
+        self.regs[0x00] = 0x11      # MODE1: SLEEP, ALLCALL
+        self.regs[0x01] = 0x04      # MODE2: OUTDRV
+        self.regs[0x05] = 0xe0      # ALLCALLADR
+        self.regs[0xfe] = 0x1e      # PRE_SCALE, 200Hz
+        self.on_write = None        # Called before each write takes effect
+
+    def _ai(self):
+        return self.regs[0x00] & 0x20
+
+    def read(self, reg, n):
+        if self._ai():
+            return bytes(self.regs[reg:reg + n])
+        return bytes([self.regs[reg]]) * n
+
+    def write(self, reg, data):
+        if self.on_write is not None:
+            self.on_write()
+        step = 1 if self._ai() else 0
+        for b in data:
+            self.regs[reg] = b
+            reg += step
+
+    def channel(self, index):
+        """ (on, off) counts of channel index. """
+        return ustruct.unpack_from('<HH', self.regs, 0x06 + 4 * index)
+
+    def duty(self, index):
+        """ Duty of channel index as 0 to 4095, decoding the full on and full
+        off bits. """
+        on, off = self.channel(index)
+        if off & 0x1000:
+            return 0
+        if on & 0x1000:
+            return 4095
+        return off & 0x0fff
+
+
+class JointSensors:
+    """ The joint position sensors. PCA9685 channels 12, 13 and 14 drive the
+    mux select lines (12 is the high bit) and the selected input is read on
+    ADC pin 36. Each joint moves while its motor is driven, at rate ADC counts
+    per second at full duty, and stops at the ends of limits. pins is the
+    (in2, in1) channel pair of each joint, as in joints.py. """
+    def __init__(self, pca, pins=((0, 1), (4, 5), (2, 3), (6, 7), (10, 11), (8, 9)),
+                 positions=None, limits=(400, 3700), rate=2000, noise=0):
+        self.pca = pca
+        self.pins = pins
+        self.positions = list(positions or [2048] * 8)
+        self.limits = limits
+        self.rate = rate
+        self.noise = noise
+        self._rand = _Noise(7)
+        self._last = utime.now_us()
+        pca.on_write = self._move       # Catch up before the motors change
+
+    def _move(self):
+        now = utime.now_us()
+        dt = (now - self._last) / 1000000.0
+        self._last = now
+        lo, hi = self.limits
+        for joint, (in2, in1) in enumerate(self.pins):
+            drive = self.pca.duty(in1) - self.pca.duty(in2)
+            if drive:
+                pos = self.positions[joint] + drive / 4095.0 * self.rate * dt
+                self.positions[joint] = max(lo, min(hi, pos))
+
+    def selected(self):
+        sel = 0
+        for ch in (12, 13, 14):
+            sel = (sel << 1) | (self.pca.duty(ch) >= 2048)
+        return sel
+
+    def __call__(self, pin):
+        self._move()
+        return int(self.positions[self.selected()]) + self._rand(self.noise)
+
+
+class ST7735:
+    """ The display's memory, filled in from the commands the driver sends.
+    dc is the DC pin number. Only CASET, RASET and RAMWR are interpreted. """
+    def __init__(self, dc, width=132, height=162):
+        self.dc = dc
+        self.width = width
+        self.height = height
+        self.mem = {}
+        self._cmd = None
+        self._args = bytearray()
+        self._half = None
+        self._win = [0, 0, 0, 0]
+        self._cx = self._cy = 0
+
+    def write(self, data):
+        if Pin.level(self.dc) == 0:
+            self._cmd = data[0]
+            self._args = bytearray()
+            if self._cmd == 0x2c:
+                self._cx, self._cy = self._win[0], self._win[1]
+                self._half = None
+            return
+        if self._cmd in (0x2a, 0x2b):
+            self._args += data
+            if len(self._args) >= 4:
+                # Only the low bytes: the driver puts the panel offset in the
+                # high byte, which the 128x128 panel ignores.
+                lo, hi = self._args[1], self._args[3]
+                if self._cmd == 0x2a:
+                    self._win[0], self._win[2] = lo, hi
+                else:
+                    self._win[1], self._win[3] = lo, hi
+        elif self._cmd == 0x2c:
+            if self._half is not None:
+                data = bytes([self._half]) + data
+                self._half = None
+            if len(data) % 2:
+                self._half = data[-1]
+                data = data[:-1]
+            x0, y0, x1, y1 = self._win
+            for i in range(0, len(data), 2):
+                self.mem[(self._cx, self._cy)] = (data[i] << 8) | data[i + 1]
+                self._cx += 1
+                if self._cx > x1:
+                    self._cx = x0
+                    self._cy += 1
+
+    def screen(self, offset=(2, 3), size=(128, 128)):
+        """ Rows of 565 colors as the driver addresses them, None where
+        nothing has been drawn. """
+        ox, oy = offset
+        return [[self.mem.get((x + ox, y + oy)) for x in range(size[0])]
+                for y in range(size[1])]
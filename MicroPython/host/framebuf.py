@@ -0,0 +1,46 @@
+# Host stand-in for MicroPython's framebuf module.
+# Only RGB565, and only the drawing calls the Cya drivers use. Pixels are
+# stored little endian, as the real module does.
+
+RGB565 = 1
+
+
+class FrameBuffer:
+    def __init__(self, buf, width, height, format=RGB565, stride=None):
+        self.buf = memoryview(buf)
+        self.width = width
+        self.height = height
+        self.stride = stride or width
+
+    def pixel(self, x, y, c=None):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = (y * self.stride + x) * 2
+            if c is None:
+                return self.buf[i] | self.buf[i + 1] << 8
+            self.buf[i] = c & 0xFF
+            self.buf[i + 1] = (c >> 8) & 0xFF
+
+    def fill_rect(self, x, y, w, h, c):
+        x0 = max(x, 0)
+        x1 = min(x + w, self.width)
+        if x1 <= x0:
+            return
+        row = bytes((c & 0xFF, (c >> 8) & 0xFF)) * (x1 - x0)
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            i = (yy * self.stride + x0) * 2
+            self.buf[i:i + len(row)] = row
+
+    def fill(self, c):
+        self.fill_rect(0, 0, self.width, self.height, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c):
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
@@ -0,0 +1,240 @@
+# Host stand-in for MicroPython's machine module.
+#
+# Pin, SPI, I2C and ADC behave enough like the ESP32 versions for Cya's
+# drivers to run on a PC. Every SPI and I2C transaction is counted, with
+# its payload bytes and a modelled bus time, in STATS. The modelled time
+# also moves the simulated utime clock forward.
+#
+# Devices are simulated by the classes in devices.py. I2C devices are
+# attached by address with I2C.attach(); something that listens to SPI is
+# attached to an SPI object with spi.attach().
+
+import utime
+
+# Fixed cost of each transaction on top of the bits on the wire: CS/DC
+# handling and driver call overhead for SPI, start/stop and turnaround
+# for I2C. Rough ESP32 figures; change them to suit your measurements.
+SPI_OVERHEAD_US = 4.0
+I2C_OVERHEAD_US = 15.0
+
+
+class BusStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.time_us = 0.0
+
+    def add(self, nbytes, time_us):
+        self.transactions += 1
+        self.bytes += nbytes
+        self.time_us += time_us
+        utime.advance(time_us)
+
+    def snapshot(self):
+        return {'transactions': self.transactions, 'bytes': self.bytes,
+                'time_us': round(self.time_us, 1)}
+
+
+STATS = {'spi': BusStats(), 'i2c': BusStats()}
+
+
+def reset_stats():
+    for bus in STATS.values():
+        bus.reset()
+
+
+def stats():
+    return dict((name, bus.snapshot()) for name, bus in STATS.items())
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    _levels = {}
+    _irqs = {}
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        Pin._levels.setdefault(id, 0)
+        if value is not None:
+            self.value(value)
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def value(self, x=None):
+        if x is None:
+            return Pin._levels[self.id]
+        Pin._levels[self.id] = 1 if x else 0
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, **kwargs):
+        Pin._irqs[self.id] = (handler, trigger)
+
+    @classmethod
+    def level(cls, id):
+        return cls._levels.get(id, 0)
+
+    @classmethod
+    def fire(cls, id):
+        """ Simulate an edge on pin id by calling its irq handler. """
+        handler = cls._irqs.get(id, (None, 0))[0]
+        if handler is not None:
+            handler(Pin(id))
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, id, baudrate=20000000, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self._device = None
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def attach(self, device):
+        self._device = device
+
+    def _count(self, n):
+        STATS['spi'].add(n, n * 8 * 1000000.0 / self.baudrate + SPI_OVERHEAD_US)
+
+    def write(self, buf):
+        self._count(len(buf))
+        if self._device is not None:
+            self._device.write(bytes(buf))
+
+    def read(self, nbytes, write=0x00):
+        self._count(nbytes)
+        return bytes(nbytes)
+
+    def readinto(self, buf, write=0x00):
+        self._count(len(buf))
+
+    def write_readinto(self, write_buf, read_buf):
+        self.write(write_buf)
+
+
+class I2C:
+    _devices = {}
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000, **kwargs):
+        self.id = id
+        self.freq = freq
+
+    @classmethod
+    def attach(cls, address, device):
+        cls._devices[address] = device
+
+    @classmethod
+    def detach_all(cls):
+        cls._devices.clear()
+
+    def scan(self):
+        return sorted(I2C._devices)
+
+    def _device(self, addr):
+        try:
+            return I2C._devices[addr]
+        except KeyError:
+            raise OSError(19)   # ENODEV, like the ESP32 port
+
+    def _count(self, payload, addressing):
+        # 9 clocks per byte (8 data + ack) plus start and stop.
+        bits = 9 * (payload + addressing) + 2
+        STATS['i2c'].add(payload, bits * 1000000.0 / self.freq + I2C_OVERHEAD_US)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        data = self._device(addr).read(memaddr, len(buf))
+        buf[:] = data
+        self._count(len(buf), 3)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        data = bytes(self._device(addr).read(memaddr, nbytes))
+        self._count(nbytes, 3)
+        return data
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self._device(addr).write(memaddr, bytes(buf))
+        self._count(len(buf), 2)
+
+    def writeto(self, addr, buf, stop=True):
+        buf = bytes(buf)
+        if buf:
+            self._device(addr).write(buf[0], buf[1:])
+        self._count(len(buf), 1)
+        return 1
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self._device(addr).read(None, len(buf))
+        self._count(len(buf), 1)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        data = bytes(self._device(addr).read(None, nbytes))
+        self._count(nbytes, 1)
+        return data
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+    WIDTH_12BIT = 3
+
+    # Called with the pin id to get each 12 bit reading.
+    source = staticmethod(lambda pin: 0)
+
+    def __init__(self, pin, atten=None):
+        self.pin = pin.id if isinstance(pin, Pin) else pin
+        self._atten = atten
+
+    def atten(self, atten):
+        self._atten = atten
+
+    def width(self, width):
+        pass
+
+    def read(self):
+        return max(0, min(4095, int(ADC.source(self.pin))))
+
+    def read_u16(self):
+        return self.read() << 4
+
+    def read_uv(self):
+        return self.read() * 3300000 // 4095
+
+
+def freq(hz=None):
+    return 240000000
+
+
+def idle():
+    pass
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
@@ -0,0 +1,28 @@
+# Host stand-in for the MicroPython "micropython" module.
+# The code emitter decorators do nothing on CPython, const() returns its
+# argument and schedule() runs the callback straight away.
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+def viper(func):
+    return func
+
+
+def schedule(func, arg):
+    func(arg)
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(*args):
+    pass
@@ -0,0 +1,31 @@
+# Make the Cya drivers importable under CPython.
+#
+#   import shim
+#   shim.install()
+#   import st7735, mpu6050, joints
+#
+# install() puts this directory (the machine, micropython, utime, ustruct,
+# framebuf and pca9685 stand-ins) and the driver directory on sys.path, and
+# provides the bits of MicroPython the drivers use without importing: the
+# const() builtin, the micropython module for decorators, and
+# time.sleep_us()/sleep_ms() on the simulated clock.
+
+import builtins
+import os
+import sys
+import time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DRIVER_DIR = os.path.dirname(HOST_DIR)
+
+
+def install():
+    for path in (DRIVER_DIR, HOST_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import micropython
+    import utime
+    builtins.const = micropython.const
+    builtins.micropython = micropython
+    time.sleep_us = utime.sleep_us
+    time.sleep_ms = utime.sleep_ms
@@ -0,0 +1,60 @@
+# Host stand-in for MicroPython's utime.
+#
+# Time is simulated. sleep_ms()/sleep_us() return at once and move the clock
+# forward, and every fake bus transaction in machine.py moves it forward by
+# its modelled duration, so code that waits on the hardware sees realistic
+# timing while the benchmarks run as fast as the host allows.
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+_now_us = 0.0
+
+
+def advance(us):
+    """ Move the simulated clock forward by us microseconds. """
+    global _now_us
+    _now_us += us
+
+
+def now_us():
+    """ Simulated time since start in microseconds, without wrapping. """
+    return _now_us
+
+
+def ticks_us():
+    return int(_now_us) & _TICKS_MAX
+
+
+def ticks_ms():
+    return int(_now_us // 1000) & _TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & _TICKS_MAX
+    return ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def sleep_us(us):
+    advance(us)
+
+
+def sleep_ms(ms):
+    advance(ms * 1000)
+
+
+def sleep(seconds):
+    advance(seconds * 1000000)
+
+
+def time():
+    return int(_now_us // 1000000)
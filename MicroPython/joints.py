@@ -4,12 +4,17 @@
 # Reads sensors to determine joint position
 
 
+import micropython
 import pca9685
+import ustruct
 import utime
+from array import array
 from machine import Pin, ADC
+from micropython import const
 
 #_DC_MOTORS = ((8, 9, 10), (13, 12, 11), (2, 3, 4), (7, 6, 5))
 _JOINT_PINS = ((0 ,1), (4, 5), (2, 3), (6, 7), (10, 11), (8, 9))
+# Sensor mux select lines on channels 12, 13 and 14 for each input; joint n is input n
 _SENSOR_SEL = ((0, 0, 0), (0, 0, 4095), (0, 4095, 0), (0, 4095, 4095), (4095, 0, 0), (4095, 0, 4095), (4095, 4095, 0), (4095, 4095, 4095))
 
 
@@ -18,21 +23,144 @@ REVERSE = const(0x01)
 COAST   = const(0x02)
 BRAKE   = const(0x03)
 
+_LED0_ON_L = const(0x06)        # First PCA9685 channel register, 4 per channel
+_CHANNELS = const(16)
+# Order read_all_sensors() visits the joints in: each one's select differs
+# from the one before in only one line. Alternate sweeps go backwards.
+_SWEEP = (2, 3, 1, 0, 4, 5)
+# A linearize() table has a point every 128 counts, 0 to 4096
+_TABLE_SHIFT = const(7)
+_TABLE_POINTS = const(33)
+# Angles are worked out as (counts * slope - offset) >> _ANGLE_SHIFT
+_ANGLE_SHIFT = const(10)
+_MIN_SPAN = const(64)           # Fewest counts between the ends of a calibrated joint
+# Calibration file: magic, version, then low, high, neutral and travel of each joint
+_CAL_FORMAT = "<4sB24H"
+_CAL_MAGIC = b"CYAJ"
+
+
+@micropython.native
+def _sort(buf, n):
+    """ Insertion sort of the first n values of buf, in place. n is small. """
+    for i in range(1, n):
+        v = buf[i]
+        j = i - 1
+        while j >= 0 and buf[j] > v:
+            buf[j + 1] = buf[j]
+            j -= 1
+        buf[j + 1] = v
+
 
 class JOINTS:
-    def __init__(self, i2c, address=0x40, freq=1600):
+    def __init__(self, i2c, address=0x40, freq=1600, settle_us=100,
+                 oversample=1, trim=0, smooth=0, use_uv=False):
         self.pca9685 = pca9685.PCA9685(i2c, address)
         self.pca9685.freq(freq)
         self._analog_in = ADC(Pin(36))         # Use pin 36 to read sensors
         self._analog_in.atten(ADC.ATTN_11DB)   # Full range 0 to 3.3V
-        
+        # With use_uv, sensor counts come from read_uv(), which is corrected
+        # with the chip's own calibration, scaled to 4095 at 3.3V. That is
+        # not the scale read() gives, so it is only used when asked for,
+        # and where this MicroPython has it.
+        self._read_uv = None
+        if use_uv:
+            self._read_uv = getattr(self._analog_in, 'read_uv', None)
+        self._table = None
+        self.filter(oversample, trim, smooth)
+        # Shadow of the ON/OFF registers of every channel. Changes go into
+        # it first and only the channels that really changed are sent, so
+        # asking for what is already set costs no bus time.
+        self._image = bytearray(4 * _CHANNELS)
+        self._image_mv = memoryview(self._image)
+        self.pca9685.i2c.readfrom_mem_into(address, _LED0_ON_L, self._image)
+        self._first = _CHANNELS         # Span of channels waiting to be sent
+        self._last = -1
+        self._pending = 0               # How many of them changed
+        self._held = False
+        self.writes = 0                 # Channel writes sent to the PCA9685
+        self.writes_saved = 0           # and those not needed
+        self.settle_us = settle_us      # Wait after changing the sensor mux
+        self.positions = array('H', [0] * 6)
+        self._backwards = False
+        # Per joint calibration: low, high and neutral counts and travel in
+        # tenths of a degree, and the slope and offset angles come from
+        self._cal = array('H', [0] * 24)
+        self._slope = array('l', [0] * 6)
+        self._offset = array('l', [0] * 6)
+
+    def _encode(self, channel, value):
+        """ Put duty value of channel into the register image, encoded as
+        pca9685.duty() does but clamped to 0 to 4095. Returns True if it
+        changed. """
+        if value <= 0:
+            on, off = 0, 4096           # Full off
+        elif value >= 4095:
+            on, off = 4096, 0           # Full on
+        else:
+            on, off = 0, value
+        image = self._image
+        i = channel << 2
+        if (image[i] == on & 0xff and image[i + 1] == on >> 8
+                and image[i + 2] == off & 0xff and image[i + 3] == off >> 8):
+            return False
+        image[i] = on & 0xff
+        image[i + 1] = on >> 8
+        image[i + 2] = off & 0xff
+        image[i + 3] = off >> 8
+        return True
+
+    def _send(self, first, last):
+        """ Write channels first to last from the image in one burst. The
+        PCA9685 steps through the registers itself (auto increment is
+        turned on by pca9685.freq()). """
+        self.pca9685.i2c.writeto_mem(self.pca9685.address, _LED0_ON_L + 4 * first,
+                                     self._image_mv[4 * first:4 * last + 4])
+
+    def _duty(self, channel, value):
+        """ Set channel to duty value, to be sent by the next _flush(). """
+        if not self._encode(channel, value):
+            self.writes_saved += 1
+            return
+        self._pending += 1
+        if channel < self._first:
+            self._first = channel
+        if channel > self._last:
+            self._last = channel
+
+    def _flush(self):
+        """ Send the channels waiting in one burst. Unchanged channels in
+        between go too, which costs less than another write. """
+        if self._last < 0:
+            return
+        self._send(self._first, self._last)
+        self.writes += 1
+        self.writes_saved += self._pending - 1
+        self._first = _CHANNELS
+        self._last = -1
+        self._pending = 0
+
+    def _update(self):
+        if not self._held:
+            self._flush()
+
+    def hold(self):
+        """
+        Keep motor changes back from the PCA9685 until flush(), so that
+        several speed() calls take effect together in one write. sensor()
+        has to set the sensor mux, so it sends anything held along with it.
+        """
+        self._held = True
+
+    def flush(self):
+        """ Send the changes kept back since hold() and stop holding. """
+        self._held = False
+        self._flush()
+
     def _pin(self, pin, value=None):
         if value is None:
-            return bool(self.pca9685.pwm(pin)[0])
-        if value:
-            self.pca9685.pwm(pin, 4096, 0)
-        else:
-            self.pca9685.pwm(pin, 0, 0)
+            return bool(self._image[4 * pin + 1] & 0x10)
+        self._duty(pin, 4095 if value else 0)
+        self._update()
 
     def speed( self, joint, value, direction ):
         in2, in1 = _JOINT_PINS[ joint ]
@@ -54,9 +182,35 @@ class JOINTS:
         else:
             print("Invalid Direction")
             return
-        self.pca9685.duty( in1, val1 )
-        self.pca9685.duty( in2, val2 )
-        
+        self._duty( in1, val1 )
+        self._duty( in2, val2 )
+        self._update()
+
+    def set_all( self, speeds, directions ):
+        """
+        Set the speed and direction of all six joints at once. speeds and
+        directions hold one value per joint, as for speed(). The motor
+        channels that changed are sent in a single I2C write, so every joint
+        starts at the same moment rather than one after another, and a tick
+        that changes nothing costs no bus time. After hold() they wait for
+        flush() instead.
+        """
+        for direction in directions:
+            if direction < FORWARD or direction > BRAKE:
+                print("Invalid Direction")
+                return
+        for joint in range(6):
+            value = speeds[ joint ]
+            direction = directions[ joint ]
+            in2, in1 = _JOINT_PINS[ joint ]
+            val1 = value if direction == FORWARD else 0
+            val2 = value if direction == REVERSE else 0
+            if direction == BRAKE:
+                val1 = val2 = 4095
+            self._duty( in1, val1 )
+            self._duty( in2, val2 )
+        self._update()
+
     def step( self, joint, value, time, direction ):
         in2, in1 = _JOINT_PINS[ joint ]
         if joint >= 6 or joint < 0 :
@@ -68,19 +222,233 @@ class JOINTS:
         elif direction == REVERSE:
             val1 = 0
             val2 = value        
-        self.pca9685.duty( in1, val1 )
-        self.pca9685.duty( in2, val2 )
+        self._duty( in1, val1 )
+        self._duty( in2, val2 )
+        self._flush()
         utime.sleep_ms( time )          # Move for the fixed amount of milliseconds
-        self.pca9685.duty( in1, 0 )     # and then coast
-        self.pca9685.duty( in2, 0 )
+        self._duty( in1, 0 )            # and then coast
+        self._duty( in2, 0 )
+        self._flush()
         
-    def sensor( self, joint ):
+    def _select( self, joint ):
+        """ Switch the sensor mux to joint and give it settle_us to settle
+        if that changed anything. Also sends any motor changes held. """
         sel1, sel2, sel3 = _SENSOR_SEL[ joint ]
-        self.pca9685.duty( 12, sel1 )   # Select the joint sensor
-        self.pca9685.duty( 13, sel2 )
-        self.pca9685.duty( 14, sel3 )
-        sensor_val = self._analog_in.read()
-        return sensor_val
+        pending = self._pending
+        self._duty( 12, sel1 )
+        self._duty( 13, sel2 )
+        self._duty( 14, sel3 )
+        changed = self._pending != pending
+        self._flush()
+        if changed:
+            utime.sleep_us( self.settle_us )
+
+    def filter( self, oversample=1, trim=0, smooth=0 ):
+        """
+        Set how sensor readings are cleaned up. Each reading is the mean of
+        oversample ADC samples, leaving out the trim lowest and trim
+        highest; trim=(oversample - 1) // 2 gives the median. Readings are
+        then smoothed per joint, each one moving the value 1/2**smooth of
+        the way to the new reading (0 is no smoothing). Changing this
+        starts the smoothing afresh.
+        """
+        if oversample < 1 or 2 * trim >= oversample:
+            raise ValueError("Nothing left after trimming")
+        self.oversample = oversample
+        self.trim = trim
+        self.smooth = smooth
+        self._samples = array('H', [0] * oversample)
+        self._smoothed = array('l', [-1] * 6)    # << smooth, -1 until first reading
+
+    def linearize( self, table=None ):
+        """
+        Correct raw ADC counts through table: 33 values giving what counts
+        0, 128, 256 ... 4096 should read as, with straight lines in between.
+        It is applied after oversampling. Not needed with use_uv, where
+        read_uv() is already corrected. None turns it off.
+        """
+        if table is None:
+            self._table = None
+            return
+        if len( table ) != _TABLE_POINTS:
+            raise ValueError("Linearization table needs 33 values")
+        self._table = array('h', table)
+
+    def _sample( self ):
+        """ One ADC reading in counts, 0 to 4095. """
+        if self._read_uv is not None:
+            # Microvolts back to counts of 3.3V / 4095, kept in small ints
+            return min( 4095, (self._read_uv() // 100 * 4095 + 16500) // 33000 )
+        return self._analog_in.read()
+
+    def _acquire( self, joint ):
+        """ A cleaned up reading of the sensor already selected. """
+        n = self.oversample
+        if n == 1:
+            value = self._sample()
+        else:
+            samples = self._samples
+            for i in range( n ):
+                samples[ i ] = self._sample()
+            trim = self.trim
+            if trim:
+                _sort( samples, n )
+            total = 0
+            for i in range( trim, n - trim ):
+                total += samples[ i ]
+            value = total // ( n - 2 * trim )
+        table = self._table
+        if table is not None:
+            i = value >> _TABLE_SHIFT
+            if i >= _TABLE_POINTS - 1:
+                value = table[ _TABLE_POINTS - 1 ]
+            else:
+                low = table[ i ]
+                value = low + ( ( table[ i + 1 ] - low ) * ( value & 127 ) >> _TABLE_SHIFT )
+        shift = self.smooth
+        if shift:
+            smoothed = self._smoothed
+            state = smoothed[ joint ]
+            if state < 0:
+                state = value << shift
+            else:
+                state += value - ( state >> shift )
+            smoothed[ joint ] = state
+            value = state >> shift
+        return value
+
+    def sensor( self, joint ):
+        self._select( joint )
+        return self._acquire( joint )
+
+    def set_calibration( self, joint, low, high, neutral, travel ):
+        """
+        Calibrate joint by hand. low and high are the sensor counts at the
+        two ends of its movement, neutral the counts where its angle is
+        zero and travel the degrees it turns from low to high. Angles are
+        positive towards high.
+        """
+        if high - low < _MIN_SPAN:
+            raise ValueError("Joint ends too close together")
+        tenths = int( travel * 10 + 0.5 )
+        cal = self._cal
+        i = 4 * joint
+        cal[ i ] = low
+        cal[ i + 1 ] = high
+        cal[ i + 2 ] = neutral
+        cal[ i + 3 ] = tenths
+        slope = ( tenths << _ANGLE_SHIFT ) // ( high - low )
+        self._slope[ joint ] = slope
+        # Rounds to the nearest tenth, without a division per reading
+        self._offset[ joint ] = neutral * slope - ( 1 << ( _ANGLE_SHIFT - 1 ) )
+
+    def calibration( self, joint ):
+        """ (low, high, neutral, travel) of joint as given to
+        set_calibration(), or None if it has not been calibrated. """
+        low, high, neutral, tenths = self._cal[ 4 * joint:4 * joint + 4 ]
+        if not tenths:
+            return None
+        return low, high, neutral, tenths / 10
+
+    def calibrate( self, joint, travel, value=2048, time=50, still=8, steps=200 ):
+        """
+        Find the ends of joint by driving it there. Put the joint at its
+        neutral position first and make sure it is free to move: it is
+        stepped with step( joint, value, time ) in reverse until the
+        sensor moves less than still counts for two steps running, then
+        forwards the same way, and then back to neutral. travel is the
+        degrees it turns between the ends. Gives up on an end after steps
+        steps. Returns (low, high, neutral).
+        """
+        smooth = self.smooth
+        self.smooth = 0                 # Smoothing would lag behind the steps
+        try:
+            neutral = self.sensor( joint )
+            ends = []
+            for direction in ( REVERSE, FORWARD ):
+                last = self.sensor( joint )
+                quiet = 0
+                for i in range( steps ):
+                    self.step( joint, value, time, direction )
+                    now = self.sensor( joint )
+                    if abs( now - last ) < still:
+                        quiet += 1
+                        if quiet == 2:
+                            break
+                    else:
+                        quiet = 0
+                    last = now
+                ends.append( now )
+            # Back from the forward end until past neutral
+            above = ends[ 1 ] > neutral
+            for i in range( steps ):
+                if ( self.sensor( joint ) > neutral ) != above:
+                    break
+                self.step( joint, value, time, REVERSE )
+        finally:
+            self.smooth = smooth
+            self._smoothed[ joint ] = -1
+        low = min( ends )
+        high = max( ends )
+        self.set_calibration( joint, low, high, neutral, travel )
+        return low, high, neutral
+
+    def save_calibration( self, filename ):
+        """ Save the joint calibrations to a small binary file. """
+        data = ustruct.pack( _CAL_FORMAT, _CAL_MAGIC, 1, *self._cal )
+        with open( filename, "wb" ) as f:
+            f.write( data )
+
+    def load_calibration( self, filename ):
+        """
+        Load calibrations saved by save_calibration(). Raises OSError if
+        the file cannot be read and ValueError if it is not a joint
+        calibration file.
+        """
+        with open( filename, "rb" ) as f:
+            data = f.read()
+        if len( data ) != ustruct.calcsize( _CAL_FORMAT ) or data[ :4 ] != _CAL_MAGIC:
+            raise ValueError("Not a joint calibration file")
+        values = ustruct.unpack( _CAL_FORMAT, data )[ 2: ]
+        for joint in range( 6 ):
+            low, high, neutral, tenths = values[ 4 * joint:4 * joint + 4 ]
+            if tenths:
+                self.set_calibration( joint, low, high, neutral, tenths / 10 )
+
+    def angle( self, joint ):
+        """ Angle of joint from neutral in tenths of a degree. Joints that
+        have not been calibrated read 0. """
+        return ( self.sensor( joint ) * self._slope[ joint ] - self._offset[ joint ] ) >> _ANGLE_SHIFT
+
+    def angles_into( self, buf ):
+        """ Read the angles of all six joints into buf, in tenths of a
+        degree as angle() gives. Returns buf. """
+        positions = self.read_all_sensors()
+        slope = self._slope
+        offset = self._offset
+        for joint in range( 6 ):
+            buf[ joint ] = ( positions[ joint ] * slope[ joint ] - offset[ joint ] ) >> _ANGLE_SHIFT
+        return buf
+
+    def read_all_sensors( self, buf=None ):
+        """
+        Read the position sensors of all six joints into buf (positions if
+        not given), indexed by joint, and return it. The joints are visited
+        so that only one mux select line changes between readings: a sweep
+        costs six single channel writes rather than eighteen.
+        """
+        if buf is None:
+            buf = self.positions
+        if self._backwards:
+            order = range( 5, -1, -1 )
+        else:
+            order = range( 6 )
+        self._backwards = not self._backwards
+        for i in order:
+            joint = _SWEEP[ i ]
+            self._select( joint )
+            buf[ joint ] = self._acquire( joint )
+        return buf
 
         
     
@@ -0,0 +1,198 @@
+# Motion events for Cya from MPU6050 samples
+#
+# MotionDetector looks at each raw sample once, as it arrives, and reports
+# when Cya starts falling, is knocked or lands hard, tips over, or takes a
+# step. It keeps only a few integers of state, so it is cheap enough to
+# run on every sample rather than rescanning a window each time round the
+# main loop.
+#
+#   imu = mpu6050.MPU6050(i2c, rate=200)
+#   imu.wake
+#   imu.irq_start(Pin(19, Pin.IN))
+#   events = motion.MotionDetector(imu.accel_counts_per_g)
+#   while True:
+#       happened = events.feed_ring(imu.ring)
+#       if happened & motion.FREE_FALL:
+#           brace()
+#
+# The MPU6050 can also watch for motion itself, see
+# MPU6050.motion_interrupt(); that is useful for waking Cya up, but it only
+# says something moved, not what.
+
+import math
+import micropython
+import utime
+from array import array
+from micropython import const
+
+# Event bits returned by feed() and feed_ring()
+FREE_FALL = const(0x01)     # Started falling
+IMPACT = const(0x02)        # A knock, tap or hard landing
+TILT = const(0x04)          # Tipped further than the tilt angle
+STEP = const(0x08)          # One step of a gait cycle
+
+# Accelerometer values are shifted down by this before squaring, so the
+# squares stay small ints. 512 counts per g at the 2g range.
+_SHIFT = const(5)
+_LP_SHIFT = const(3)        # Low pass filter used for tilt: 1/8 new each sample
+
+
+class MotionDetector:
+    """
+    Watches raw accelerometer samples for motion events. counts_per_g is
+    the accelerometer sensitivity (MPU6050.accel_counts_per_g). Thresholds
+    are in g, degrees and milliseconds:
+
+    free_fall, free_fall_ms: total acceleration below free_fall for at
+        least free_fall_ms starts a free fall, which ends when it rises
+        above free_fall + hysteresis.
+    impact, impact_quiet_ms: total acceleration above impact is a knock.
+        Another is not reported until it has dropped below impact -
+        hysteresis and impact_quiet_ms have passed.
+    tilt, tilt_hysteresis: Z tipped more than tilt degrees from straight
+        up, judged from low pass filtered acceleration. Clears when back
+        within tilt - tilt_hysteresis.
+    step_high, step_low, step_min_ms: a step is total acceleration rising
+        above step_high and falling back below step_low, at least
+        step_min_ms after the last step.
+
+    handler, if given, is called with the event bit and the sample's ticks
+    whenever an event starts.
+    """
+    def __init__(
+        self, counts_per_g=16384,
+        free_fall=0.35, free_fall_ms=60, hysteresis=0.1,
+        impact=2.0, impact_quiet_ms=100,
+        tilt=35, tilt_hysteresis=5,
+        step_high=1.15, step_low=0.95, step_min_ms=250,
+        handler=None
+    ):
+        g = counts_per_g >> _SHIFT
+        g2 = g * g
+        # Squared thresholds in shifted counts
+        self._ff_in = int(g2 * free_fall * free_fall)
+        self._ff_out = int(g2 * (free_fall + hysteresis) ** 2)
+        self._impact_in = int(g2 * impact * impact)
+        self._impact_out = int(g2 * (impact - hysteresis) ** 2)
+        self._step_high = int(g2 * step_high * step_high)
+        self._step_low = int(g2 * step_low * step_low)
+        # cos squared of the tilt angles, out of 256
+        self._tilt_in = int(256 * math.cos(math.radians(tilt)) ** 2)
+        self._tilt_out = int(256 * math.cos(math.radians(tilt - tilt_hysteresis)) ** 2)
+        self._ff_us = free_fall_ms * 1000
+        self._quiet_us = impact_quiet_ms * 1000
+        self._step_us = step_min_ms * 1000
+        self.handler = handler
+
+        self.active = 0             # FREE_FALL and TILT while they last
+        self.steps = 0
+        self.impacts = 0
+        self.falls = 0
+        self._g = g
+        self._lp = array("l", [0, 0, g << _LP_SHIFT])  # Filtered x, y, z << _LP_SHIFT
+        self._low_since = None      # When acceleration went below free_fall
+        self._impact_at = 0
+        self._impact_armed = True
+        self._step_up = False
+        self._step_at = None        # None until the first step
+        self._sample = array("h", [0] * 7)
+
+    def reset(self):
+        """ Clear the events in progress, the counts and the tilt filter. """
+        self.active = 0
+        self.steps = self.impacts = self.falls = 0
+        self._low_since = None
+        self._impact_armed = True
+        self._step_up = False
+        self._step_at = None
+        lp = self._lp
+        lp[0] = lp[1] = 0
+        lp[2] = self._g << _LP_SHIFT
+
+    @micropython.native
+    def feed(self, sample, ticks=None):
+        """
+        Look at one raw sample (accel X, Y, Z first, as from
+        MPU6050.read_raw_into() or SampleRing.get()). ticks is when it was
+        taken, in utime.ticks_us(); now if not given. Returns the bits of
+        the events that started with this sample.
+        """
+        if ticks is None:
+            ticks = utime.ticks_us()
+        x = sample[0] >> _SHIFT
+        y = sample[1] >> _SHIFT
+        z = sample[2] >> _SHIFT
+        m2 = x * x + y * y + z * z
+        events = 0
+
+        # Free fall
+        if self.active & FREE_FALL:
+            if m2 > self._ff_out:
+                self.active &= ~FREE_FALL
+                self._low_since = None
+        elif m2 < self._ff_in:
+            if self._low_since is None:
+                self._low_since = ticks
+            elif utime.ticks_diff(ticks, self._low_since) >= self._ff_us:
+                self.active |= FREE_FALL
+                self.falls += 1
+                events |= FREE_FALL
+        else:
+            self._low_since = None
+
+        # Impact
+        if self._impact_armed:
+            if m2 > self._impact_in:
+                self._impact_armed = False
+                self._impact_at = ticks
+                self.impacts += 1
+                events |= IMPACT
+        elif m2 < self._impact_out and utime.ticks_diff(ticks, self._impact_at) >= self._quiet_us:
+            self._impact_armed = True
+
+        # Steps
+        if self._step_up:
+            if m2 < self._step_low:
+                self._step_up = False
+                if (self._step_at is None
+                        or utime.ticks_diff(ticks, self._step_at) >= self._step_us):
+                    self._step_at = ticks
+                    self.steps += 1
+                    events |= STEP
+        elif m2 > self._step_high:
+            self._step_up = True
+
+        # Tilt, from filtered acceleration: tipped past the angle when
+        # z / |a| < cos(angle), worked in squares out of 256
+        lp = self._lp
+        lp[0] += x - (lp[0] >> _LP_SHIFT)
+        lp[1] += y - (lp[1] >> _LP_SHIFT)
+        lp[2] += z - (lp[2] >> _LP_SHIFT)
+        fx = lp[0] >> _LP_SHIFT
+        fy = lp[1] >> _LP_SHIFT
+        fz = lp[2] >> _LP_SHIFT
+        f2 = fx * fx + fy * fy + fz * fz
+        up2 = fz * fz * 256 if fz > 0 else 0
+        if self.active & TILT:
+            if up2 > self._tilt_out * f2:
+                self.active &= ~TILT
+        elif up2 < self._tilt_in * f2:
+            self.active |= TILT
+            events |= TILT
+
+        if events and self.handler is not None:
+            for bit in (FREE_FALL, IMPACT, TILT, STEP):
+                if events & bit:
+                    self.handler(bit, ticks)
+        return events
+
+    def feed_ring(self, ring):
+        """ Feed every sample waiting in ring (an mpu6050.SampleRing),
+        taking them out. Returns the bits of all the events that started. """
+        events = 0
+        sample = self._sample
+        while True:
+            ticks = ring.get(sample)
+            if ticks is None:
+                return events
+            events |= self.feed(sample, ticks)
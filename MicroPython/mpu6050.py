@@ -29,8 +29,10 @@ MicroPython I2C driver for MPU6050 6-axis motion tracking device
 __version__ = "0.9.0"
 
 # pylint: disable=import-error
+import micropython
 import ustruct
 import utime
+from array import array
 # from machine import I2C, Pin
 from micropython import const
 # pylint: enable=import-error
@@ -49,6 +51,10 @@ _CONFIG = const(0x1a)
 _GYRO_CONFIG = const(0x1b)
 _ACCEL_CONFIG = const(0x1c)
 
+# Motion detection register addresses
+_MOT_THR = const(0x1f)          # Threshold, 2mg per count
+_MOT_DUR = const(0x20)          # Duration, 1ms per count
+
 # FIFO Enable register address
 _FIFO_EN = const(0x23)
 
@@ -73,11 +79,35 @@ _I2C_SLV4_CTRL = const(0x34)
 _I2C_SLV4_DI = const(0x35)
 _I2C_MST_STATUS = const(0x36)
 
+# Auxiliary I2C field values
+_WAIT_FOR_ES = const(0x40)      # I2C_MST_CTRL: hold data ready until slaves read
+I2C_MST_CLK_400KHZ = const(13)  # I2C_MST_CTRL clock settings
+I2C_MST_CLK_258KHZ = const(8)
+I2C_MST_CLK_500KHZ = const(9)
+_SLV_READ = const(0x80)         # I2C_SLVx_ADDR: read from the slave
+_SLV_EN = const(0x80)           # I2C_SLVx_CTRL: slave enabled
+_SLV_BYTE_SW = const(0x40)      # I2C_SLVx_CTRL: swap the bytes of each word
+_SLV4_DONE = const(0x40)        # I2C_MST_STATUS: SLV4 transfer finished
+_SLV4_NACK = const(0x10)        # I2C_MST_STATUS: SLV4 not acknowledged
+_EXT_SENS_SIZE = const(24)      # Bytes of EXT_SENS_DATA
+
 # Interrupt configuration register addresses
 _INT_PIN_CFG = const(0x37)
 _INT_ENABLE = const(0x38)
 _INT_STATUS = const(0x3a)
 
+# Interrupt pin configuration register field values
+_INT_LEVEL_LOW = const(0x80)    # INT pin is active low
+_INT_OPEN = const(0x40)         # INT pin is open drain
+_LATCH_INT_EN = const(0x20)     # INT pin stays active until cleared
+_INT_RD_CLEAR = const(0x10)     # Any read clears the interrupt flags
+_I2C_BYPASS_EN = const(0x02)    # Connect the auxiliary I2C bus to the main one
+
+# Interrupt enable and status register field values
+_MOT_INT = const(0x40)          # Motion detected
+_FIFO_OFLOW_INT = const(0x10)   # The FIFO overflowed
+_DATA_RDY_INT = const(0x01)     # A new sample is in the data registers
+
 # Accelerometer measurement register addresses
 _ACCEL_XOUT_H = const(0x3b)
 _ACCEL_XOUT_L = const(0x3c)
@@ -162,6 +192,21 @@ _FIFO_COUNTH = const(0x72)      # High byte of number of bytes in FIFO
 _FIFO_COUNTL = const(0x73)      # Low byte of number of bytes in FIFO
 _FIFO_R_W = const(0x74)         # Address to Read/Write data from/to FIFO
 
+# FIFO Enable register field values. Choose which sensors feed the FIFO.
+FIFO_TEMP = const(0x80)
+FIFO_GYRO_X = const(0x40)
+FIFO_GYRO_Y = const(0x20)
+FIFO_GYRO_Z = const(0x10)
+FIFO_GYRO = const(0x70)         # All three gyro axes
+FIFO_ACCEL = const(0x08)        # All three accelerometer axes
+
+# User control register field values
+_USER_FIFO_EN = const(0x40)     # Enable the FIFO
+_USER_I2C_MST_EN = const(0x20)  # Enable the auxiliary I2C master
+_USER_FIFO_RESET = const(0x04)  # Empty the FIFO, clears itself
+
+_FIFO_SIZE = const(1024)        # Bytes the FIFO holds
+
 # I2C bus address register. Should contain 0x68. Does not reflect the AD0 pin.
 _WHO_AM_I = const(0x75)
 
@@ -187,18 +232,208 @@ _GYRO_SO_500DPS = 62.5
 _GYRO_SO_1000DPS = 32.8
 _GYRO_SO_2000DPS = 16.4
 
+# Digital low pass filter bandwidths (accelerometer/gyro). With the filter
+# off (260Hz) the gyro is sampled at 8kHz, otherwise at 1kHz. Narrower
+# bandwidths smooth more but delay the signal more.
+DLPF_CFG_260HZ = const(0)       # 0.0ms delay
+DLPF_CFG_184HZ = const(1)       # 2.0ms delay
+DLPF_CFG_94HZ = const(2)        # 3.0ms delay
+DLPF_CFG_44HZ = const(3)        # 4.9ms delay
+DLPF_CFG_21HZ = const(4)        # 8.5ms delay
+DLPF_CFG_10HZ = const(5)        # 13.8ms delay
+DLPF_CFG_5HZ = const(6)         # 19.0ms delay
+
+# Calibration file: magic, version, accel and gyro sensitivity (x10) the
+# biases were measured at, accel bias, gyro bias, temperature, gyro
+# temperature slopes
+_CAL_FORMAT = "<4sBHH3h3hh3l"
+_CAL_MAGIC = b"MPUC"
+
+# Positions of the values in a raw sample, see SampleRing
+AXIS_AX = const(0)
+AXIS_AY = const(1)
+AXIS_AZ = const(2)
+AXIS_TEMP = const(3)
+AXIS_GX = const(4)
+AXIS_GY = const(5)
+AXIS_GZ = const(6)
+
 SF_G = 1
 SF_M_S2 = 9.80665 # 1 g = 9.80665 m/s2 ie. standard gravity
 SF_DEG_S = 1
 SF_RAD_S = 0.017453292519943 # 1 deg/s is 0.017453292519943 rad/s
 
+@micropython.native
+def _be16(src, start, dst, index, count):
+    """ Decode count big endian int16 values from src at byte start into
+    dst from index. """
+    j = start
+    for i in range(index, index + count):
+        value = (src[j] << 8) | src[j + 1]
+        if value & 0x8000:
+            value -= 0x10000
+        dst[i] = value
+        j += 2
+
+@micropython.native
+def _be16_less(src, dst, bias, first, count):
+    """ Decode count big endian int16 values from src into dst, less the
+    biases from bias[first], clamped to the int16 range. """
+    j = 0
+    for i in range(count):
+        value = (src[j] << 8) | src[j + 1]
+        if value & 0x8000:
+            value -= 0x10000
+        value -= bias[first + i]
+        if value > 32767:
+            value = 32767
+        elif value < -32768:
+            value = -32768
+        dst[i] = value
+        j += 2
+
+@micropython.native
+def _scan(data, slots, slot, count, axis):
+    """ Returns the first value, the sum and sum of squares of the
+    differences from it, the minimum and the maximum of axis over count
+    samples from slot. Taking the sums about the first value keeps them
+    small ints and exact. """
+    first = data[7 * slot + axis]
+    s1 = 0
+    s2 = 0
+    lo = first
+    hi = first
+    for k in range(count):
+        value = data[7 * slot + axis]
+        d = value - first
+        s1 += d
+        s2 += d * d
+        if value < lo:
+            lo = value
+        if value > hi:
+            hi = value
+        slot += 1
+        if slot == slots:
+            slot = 0
+    return first, s1, s2, lo, hi
+
+@micropython.native
+def _decimate(data, slots, slot, blocks, factor, dst):
+    """ Average each factor samples from slot into one in dst, blocks times. """
+    half = factor // 2
+    i = 0
+    for b in range(blocks):
+        for axis in range(7):
+            total = 0
+            k = slot
+            for j in range(factor):
+                total += data[7 * k + axis]
+                k += 1
+                if k == slots:
+                    k = 0
+            dst[i] = (total + half) // factor
+            i += 1
+        slot = k
+
+class SampleRing:
+    """
+    Circular buffer of raw samples, each seven int16 values (accel X, Y, Z,
+    temperature, gyro X, Y, Z) and the utime.ticks_us() it was taken at.
+    Holds the latest size samples; when full the oldest is overwritten and
+    counted in overruns. Everything is allocated up front so samples can be
+    added from a scheduled interrupt handler.
+
+    The batch methods work over the latest count samples (all of them if
+    count is 0) without taking them out, in raw units. Axis numbers are
+    the positions in a sample, using the AXIS_ values.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self._slots = size + 1          # One slot is always empty
+        self.data = array("h", [0] * (7 * self._slots))
+        self.ticks = array("l", [0] * self._slots)
+        self._head = 0                  # Slot the next sample goes in
+        self._tail = 0                  # Oldest sample
+        self.overruns = 0
+
+    def __len__(self):
+        return (self._head - self._tail) % self._slots
+
+    def clear(self):
+        self._tail = self._head
+
+    def put(self, src, start, ticks):
+        """ Add the seven big endian int16 values in src from byte start. """
+        head = self._head
+        _be16(src, start, self.data, 7 * head, 7)
+        self.ticks[head] = ticks
+        head = (head + 1) % self._slots
+        if head == self._tail:
+            self._tail = (head + 1) % self._slots
+            self.overruns += 1
+        self._head = head
+
+    def get(self, buf):
+        """
+        Remove the oldest sample, copying its seven values into buf.
+        Returns its timestamp, or None if the ring is empty.
+        """
+        tail = self._tail
+        if tail == self._head:
+            return None
+        i = 7 * tail
+        for j in range(7):
+            buf[j] = self.data[i + j]
+        self._tail = (tail + 1) % self._slots
+        return self.ticks[tail]
+
+    def stats(self, axis, count=0):
+        """ (mean, variance, min, max) of axis. """
+        count, slot = self._latest(count)
+        if not count:
+            return (0.0, 0.0, 0, 0)
+        first, s1, s2, lo, hi = _scan(self.data, self._slots, slot, count, axis)
+        return (first + s1 / count, (s2 - s1 * s1 / count) / count, lo, hi)
+
+    def mean_into(self, buf, count=0):
+        """ Store the mean of each of the seven axes in buf. Returns buf. """
+        count, slot = self._latest(count)
+        for axis in range(7):
+            if count:
+                first, s1, s2, lo, hi = _scan(self.data, self._slots, slot, count, axis)
+                buf[axis] = first + s1 / count
+            else:
+                buf[axis] = 0
+        return buf
+
+    def decimate(self, dst, factor, count=0):
+        """
+        Average each run of factor samples into one and store them in dst
+        (an array("h")), seven values each, oldest first. If count is not a
+        multiple of factor the oldest samples left over are skipped. Returns
+        the number of samples stored.
+        """
+        count, slot = self._latest(count)
+        blocks = min(count // factor, len(dst) // 7)
+        count, slot = self._latest(blocks * factor)
+        _decimate(self.data, self._slots, slot, blocks, factor, dst)
+        return blocks
+
+    def _latest(self, count):
+        """ The number of samples to use for count and the slot of the
+        first of them. """
+        n = len(self)
+        if not count or count > n:
+            count = n
+        return count, (self._head - count) % self._slots
+
 class MPU6050:
     """Class which provides interface to MPU6050 6-axis motion tracking device."""
     def __init__(
         self, i2c, address=0x68,
         accel_fs=ACCEL_FS_SEL_2G, gyro_fs=GYRO_FS_SEL_250DPS,
         accel_sf=SF_M_S2, gyro_sf=SF_RAD_S,
-        gyro_offset=(0, 0, 0)
+        gyro_offset=(0, 0, 0), dlpf=DLPF_CFG_260HZ, rate=None
     ):
         self.i2c = i2c
         self.address = address
@@ -212,7 +447,39 @@ class MPU6050:
         self._gyro_so = self._gyro_fs(gyro_fs)
         self._accel_sf = accel_sf
         self._gyro_sf = gyro_sf
-        self._gyro_offset = gyro_offset
+        # Output units per raw count
+        self.accel_scale = accel_sf / self._accel_so
+        self.gyro_scale = gyro_sf / self._gyro_so
+        # Biases in raw counts to take off each value of a raw sample: accel
+        # X, Y, Z, temperature (always 0), gyro X, Y, Z. The gyro bias is
+        # _gyro_bias at _cal_temp and moves by _gyro_slope/65536 counts per
+        # temperature count; _bias has it for the last temperature read, _temp.
+        self._bias = array("h", [0] * 7)
+        self._gyro_bias = array("h", [0, 0, 0])
+        self._gyro_slope = array("l", [0, 0, 0])
+        self._cal_temp = 0
+        self._temp = 0
+        self._calibrated = False
+        self._set_gyro_offset(gyro_offset)
+        # A sample and whatever the auxiliary slaves put in EXT_SENS_DATA,
+        # which follows it; _raw_mv covers the part read in each burst.
+        self._raw = bytearray(14 + _EXT_SENS_SIZE)
+        self._raw_mv = memoryview(self._raw)[:14]
+        self._aux_len = bytearray(4)
+        self.ext_data = memoryview(self._raw)[14:14]
+        self._raw6 = bytearray(6)
+        self._fifo_buf = None
+        self.fifo_data = None
+        self.fifo_words = 0
+        self.fifo_overflows = 0
+        self.ring = None
+        self.irq_missed = 0
+        self.motion_count = 0
+        self._int_pin = None
+        self._int_buf = bytearray(15)
+        self._capture_ref = self._capture
+        self.dlpf(dlpf)
+        self.sample_rate(rate)
 
         # Use the x axis gyro for clock, but don't wake the chip up
         self._register_char( _PWR_MGMT_1, value=_SLEEP | _CLKSEL_XPLL )
@@ -250,34 +517,28 @@ class MPU6050:
         return values in g if constructor was provided `accel_sf=SF_M_S2`
         parameter.
         """
-        so = self._accel_so
-        sf = self._accel_sf
+        s = self.accel_scale
+        b = self._bias
 
-        xyz = self._register_three_shorts(_ACCEL_XOUT_H)
-        return tuple([value / so * sf for value in xyz])
+        x, y, z = self._register_three_shorts(_ACCEL_XOUT_H)
+        return ((x - b[0]) * s, (y - b[1]) * s, (z - b[2]) * s)
 
     @property
     def gyro(self):
         """
         X, Y, Z radians per second as floats.
         """
-        so = self._gyro_so
-        sf = self._gyro_sf
-        ox, oy, oz = self._gyro_offset
-
-        xyz = self._register_three_shorts(_GYRO_XOUT_H)
-        xyz = [value / so * sf for value in xyz]
-
-        xyz[0] -= ox
-        xyz[1] -= oy
-        xyz[2] -= oz
+        s = self.gyro_scale
+        b = self._bias
 
-        return tuple(xyz)
+        x, y, z = self._register_three_shorts(_GYRO_XOUT_H)
+        return ((x - b[4]) * s, (y - b[5]) * s, (z - b[6]) * s)
 
     @property
     def temperature(self):
         """ Temperature of the chip (not ambient) in celsius. """
         temp = self._register_short( _TEMP_OUT_H )
+        self._track_temp(temp)
         # MPU6050 datasheet specifies this formula
         return ((temp / 340.0 ) + 36.53 )
 
@@ -287,26 +548,447 @@ class MPU6050:
         temp = self.temperature
         return (((temp * 9.0) / 5.0 ) + 32.0)
     
+    def read_into(self, buf):
+        """
+        Read acceleration, temperature and gyro in one I2C transfer, so all
+        seven come from the same sample, and store them in buf (for
+        example an array("f") of 7) as ax, ay, az, temp, gx, gy, gz. The
+        units are those of acceleration, temperature and gyro. Returns buf.
+        """
+        ax, ay, az, temp, gx, gy, gz = self._read_raw()
+        self._track_temp(temp)
+        a = self.accel_scale
+        g = self.gyro_scale
+        b = self._bias
+        buf[0] = (ax - b[0]) * a
+        buf[1] = (ay - b[1]) * a
+        buf[2] = (az - b[2]) * a
+        buf[3] = temp / 340.0 + 36.53
+        buf[4] = (gx - b[4]) * g
+        buf[5] = (gy - b[5]) * g
+        buf[6] = (gz - b[6]) * g
+        return buf
+
+    def read_raw_into(self, buf):
+        """
+        Read a whole sample in one transfer like read_into(), but store the
+        raw int16 values, less the calibrated biases, in buf (for example an
+        array("h") of 7). Multiply by accel_scale or gyro_scale to get the
+        usual units, or better, scale your thresholds once and compare raw
+        values. Temperature is left as read. Returns buf.
+        """
+        raw = self._raw
+        self.i2c.readfrom_mem_into(self.address, _ACCEL_XOUT_H, self._raw_mv)
+        temp = (raw[6] << 8) | raw[7]
+        if temp & 0x8000:
+            temp -= 0x10000
+        self._track_temp(temp)
+        _be16_less(raw, buf, self._bias, 0, 7)
+        return buf
+
+    def accel_raw_into(self, buf):
+        """ Raw acceleration X, Y, Z, less the calibrated bias, into buf.
+        Returns buf. """
+        self.i2c.readfrom_mem_into(self.address, _ACCEL_XOUT_H, self._raw6)
+        _be16_less(self._raw6, buf, self._bias, 0, 3)
+        return buf
+
+    def gyro_raw_into(self, buf):
+        """ Raw gyro X, Y, Z, less the calibrated bias, into buf. The bias
+        is for the last temperature read. Returns buf. """
+        self.i2c.readfrom_mem_into(self.address, _GYRO_XOUT_H, self._raw6)
+        _be16_less(self._raw6, buf, self._bias, 4, 3)
+        return buf
+
+    def accel_range(self, accel_fs):
+        """ Change the accelerometer full scale range to one of the
+        ACCEL_FS_SEL_ values. """
+        so = self._accel_fs(accel_fs)
+        for i in range(3):
+            self._bias[i] = round(self._bias[i] * so / self._accel_so)
+        self._accel_so = so
+        self.accel_scale = self._accel_sf / so
+
+    def gyro_range(self, gyro_fs):
+        """ Change the gyro full scale range to one of the GYRO_FS_SEL_
+        values. """
+        so = self._gyro_fs(gyro_fs)
+        for i in range(3):
+            self._gyro_bias[i] = round(self._gyro_bias[i] * so / self._gyro_so)
+            self._gyro_slope[i] = round(self._gyro_slope[i] * so / self._gyro_so)
+        self._gyro_so = so
+        self.gyro_scale = self._gyro_sf / so
+        self._track_temp(self._temp, True)
+
+    def read_all(self):
+        """
+        The same as read_into() but returns a new 7-tuple. Use read_into()
+        in loops to save allocating one each time.
+        """
+        return tuple(self.read_into([0.0] * 7))
+
     @property
     def whoami(self):
         """ Value of the whoami register. SHOULD be 0x68 """
         return self._register_char(_WHO_AM_I)
 
-    def calibrate(self, count=256, delay=0):
-        ox, oy, oz = (0.0, 0.0, 0.0)
-        self._gyro_offset = (0.0, 0.0, 0.0)
-        n = float(count)
+    def calibrate(self, count=256, delay=0, accel=True):
+        """
+        Measure the gyro bias, and the accelerometer bias if accel is True,
+        from count samples. Cya must be sitting still, and level for the
+        accelerometer (Z up). Each sample is one burst read, taken every
+        delay ms or, if delay is 0, once per sample period, and summed in
+        integers.
+
+        If there is an earlier calibration from at least 2C warmer or
+        cooler, the difference between the two gives how the gyro bias
+        changes with temperature, which is then corrected for from the
+        temperature read with each sample.
+
+        Returns the gyro offset in gyro units, as the driver always has.
+        Use save_calibration() and load_calibration() to skip this on the
+        next start:
+
+            try:
+                mpu.load_calibration("mpu.cal")
+            except OSError:
+                mpu.calibrate()
+                mpu.save_calibration("mpu.cal")
+        """
+        sums = [0] * 7
+        for n in range(count):
+            if delay:
+                utime.sleep_ms(delay)
+            else:
+                utime.sleep_us(self.sample_period_us)
+            raw = self._read_raw()
+            for i in range(7):
+                sums[i] += raw[i]
+        means = [(total + count // 2) // count for total in sums]
+
+        temp = means[3]
+        if self._calibrated and abs(temp - self._cal_temp) >= 680:
+            for i in range(3):
+                change = means[4 + i] - self._gyro_bias[i]
+                self._gyro_slope[i] = (change << 16) // (temp - self._cal_temp)
+        for i in range(3):
+            self._gyro_bias[i] = means[4 + i]
+            if accel:
+                self._bias[i] = means[i]
+        if accel:
+            self._bias[2] -= self._accel_so     # 1g
+        self._cal_temp = temp
+        self._calibrated = True
+        self._track_temp(temp, True)
+        g = self.gyro_scale
+        b = self._gyro_bias
+        return (b[0] * g, b[1] * g, b[2] * g)
+
+    def save_calibration(self, filename):
+        """ Save the calibration to a small binary file. """
+        data = ustruct.pack(
+            _CAL_FORMAT, _CAL_MAGIC, 1, self._accel_so, int(self._gyro_so * 10),
+            *(tuple(self._bias[0:3]) + tuple(self._gyro_bias) + (self._cal_temp,)
+              + tuple(self._gyro_slope))
+        )
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def load_calibration(self, filename):
+        """
+        Load a calibration saved by save_calibration(), adjusting it if the
+        full scale ranges have changed since. Raises OSError if the file
+        cannot be read and ValueError if it is not a calibration file.
+        """
+        with open(filename, "rb") as f:
+            data = f.read()
+        if len(data) != ustruct.calcsize(_CAL_FORMAT) or data[:4] != _CAL_MAGIC:
+            raise ValueError("Not an MPU6050 calibration file")
+        values = ustruct.unpack(_CAL_FORMAT, data)
+        accel_so = values[2]
+        gyro_so = values[3] / 10
+        for i in range(3):
+            self._bias[i] = round(values[4 + i] * self._accel_so / accel_so)
+            self._gyro_bias[i] = round(values[7 + i] * self._gyro_so / gyro_so)
+            self._gyro_slope[i] = round(values[11 + i] * self._gyro_so / gyro_so)
+        self._cal_temp = values[10]
+        self._calibrated = True
+        self._track_temp(self._temp, True)
+
+    def dlpf(self, value):
+        """
+        Set the digital low pass filter to one of the DLPF_CFG_ values.
+        This changes the rate the gyro is sampled at, so call sample_rate()
+        again afterwards.
+        """
+        config = self._register_char(_CONFIG)
+        self._register_char(_CONFIG, (config & 0xf8) | value)
+        self._gyro_rate = 8000 if value == DLPF_CFG_260HZ else 1000
+
+    def sample_rate(self, rate=None):
+        """
+        Set how many samples a second the chip produces, as near to rate
+        as the divider allows. None gives the fastest rate for the filter
+        setting. Returns the rate chosen. The time between samples is kept
+        in sample_period_us, so readers can wait exactly one period between
+        reads rather than polling for new data.
+        """
+        div = 0
+        if rate is not None:
+            div = min(255, max(0, int(self._gyro_rate / rate + 0.5) - 1))
+        self._register_char(_SMPLRT_DIV, div)
+        self.sample_period_us = (1 + div) * 1000000 // self._gyro_rate
+        return self._gyro_rate / (1 + div)
+
+    @property
+    def data_ready(self):
+        """
+        True if a new sample has arrived since data_ready was last read.
+        Reading it clears the flag, along with the chip's other interrupt
+        flags.
+        """
+        return bool(self._register_char(_INT_STATUS) & _DATA_RDY_INT)
+
+    def irq_start(self, pin, ring=None):
+        """
+        Capture every sample into a SampleRing as it arrives. pin is the
+        machine.Pin wired to the chip's INT output, set up as an input. The
+        interrupt handler notes the time and schedules the read, so each
+        sample is timestamped when it was ready rather than when Python got
+        round to it. ring defaults to a new SampleRing(64), kept in ring.
+        FIFO overflows are counted in fifo_overflows and the FIFO reset.
+        """
+        self.ring = ring if ring is not None else SampleRing()
+        self._int_pin = pin
+        # Active high, push-pull, 50us pulse per sample
+        int_pin_cfg = self._register_char(_INT_PIN_CFG) & _I2C_BYPASS_EN
+        self._register_char(_INT_PIN_CFG, int_pin_cfg)
+        int_enable = self._register_char(_INT_ENABLE) & _MOT_INT
+        self._register_char(_INT_ENABLE, int_enable | _DATA_RDY_INT | _FIFO_OFLOW_INT)
+        pin.irq(trigger=pin.IRQ_RISING, handler=self._irq)
+
+    def irq_stop(self):
+        """ Stop capturing samples into ring. """
+        int_enable = self._register_char(_INT_ENABLE) & _MOT_INT
+        self._register_char(_INT_ENABLE, int_enable)
+        if self._int_pin is not None:
+            self._int_pin.irq(handler=None)
+            self._int_pin = None
+
+    def _irq(self, pin):
+        try:
+            micropython.schedule(self._capture_ref, utime.ticks_us())
+        except RuntimeError:
+            self.irq_missed += 1        # Schedule queue full
+
+    def _capture(self, ticks):
+        # INT_STATUS and all the data registers in one read
+        buf = self._int_buf
+        self.i2c.readfrom_mem_into(self.address, _INT_STATUS, buf)
+        if buf[0] & _FIFO_OFLOW_INT:
+            self.fifo_overflows += 1
+            self.fifo_reset()
+        if buf[0] & _MOT_INT:
+            self.motion_count += 1
+        if buf[0] & _DATA_RDY_INT:
+            self.ring.put(buf, 1, ticks)
+
+    def motion_interrupt(self, threshold=0.1, duration=1):
+        """
+        Have the chip watch for motion itself: acceleration changing by
+        more than threshold g (in 2mg steps) for duration ms. A threshold
+        of 0 turns it off. Motion pulses the INT pin, so with irq_start()
+        it is counted in motion_count; otherwise poll motion_detected.
+        """
+        count = min(255, int(threshold * 500))
+        self._register_char(_MOT_THR, count)
+        self._register_char(_MOT_DUR, min(255, duration))
+        int_enable = self._register_char(_INT_ENABLE) & ~_MOT_INT
+        self._register_char(_INT_ENABLE, int_enable | (_MOT_INT if count else 0))
+
+    @property
+    def motion_detected(self):
+        """
+        True if the chip has seen motion (see motion_interrupt()) since
+        this was last read. Reading it clears the chip's interrupt flags.
+        """
+        return bool(self._register_char(_INT_STATUS) & _MOT_INT)
+
+    def aux_enable(self, clock=I2C_MST_CLK_400KHZ):
+        """
+        Start the MPU6050's own I2C master on the auxiliary bus (XDA/XCL)
+        so it can read other sensors, such as a magnetometer, once per
+        sample. See aux_slot(). clock is one of the I2C_MST_CLK_ values.
+        Data ready then waits until the slaves have been read, so their
+        data always belongs with the sample.
+        """
+        int_pin_cfg = self._register_char(_INT_PIN_CFG)
+        self._register_char(_INT_PIN_CFG, int_pin_cfg & ~_I2C_BYPASS_EN)
+        self._register_char(_I2C_MST_CTRL, _WAIT_FOR_ES | clock)
+        user_ctrl = self._register_char(_USER_CTRL)
+        self._register_char(_USER_CTRL, user_ctrl | _USER_I2C_MST_EN)
+
+    def aux_disable(self):
+        """ Stop the auxiliary I2C master and turn off all the slots. """
+        user_ctrl = self._register_char(_USER_CTRL)
+        self._register_char(_USER_CTRL, user_ctrl & ~_USER_I2C_MST_EN)
+        for slot in range(4):
+            self.aux_slot(slot, 0, 0, 0)
+
+    def aux_slot(self, slot, address, register, length, swap=False):
+        """
+        Have the auxiliary master read length bytes (up to 15, and 24 in
+        all) from register of the slave at address every sample, using
+        slot 0 to 3. A length of 0 turns the slot off. swap swaps the bytes of each
+        16 bit word, for little endian sensors.
+
+        The slots' data follows the sample in EXT_SENS_DATA in slot order,
+        and is read in the same burst by read_into(), read_raw_into() and
+        the rest. After each read ext_data holds it. Returns the offset of
+        this slot's data in ext_data.
+        """
+        if not 0 <= length <= 15:
+            raise ValueError("A slot reads 0 to 15 bytes")
+        total = sum(self._aux_len) - self._aux_len[slot] + length
+        if total > _EXT_SENS_SIZE:
+            raise ValueError("Auxiliary slots read more than 24 bytes")
+        base = _I2C_SLV0_ADDR + 3 * slot
+        ctrl = 0
+        if length:
+            ctrl = _SLV_EN | (_SLV_BYTE_SW if swap else 0) | length
+            self._register_char(base, _SLV_READ | address)
+            self._register_char(base + 1, register)
+        self._register_char(base + 2, ctrl)
+        self._aux_len[slot] = length
+        self._raw_mv = memoryview(self._raw)[:14 + total]
+        self.ext_data = memoryview(self._raw)[14:14 + total]
+        return sum(self._aux_len[:slot])
+
+    def aux_write(self, address, register, value):
+        """ Write one byte to register of the slave at address on the
+        auxiliary bus, for example to set up a magnetometer. """
+        self._register_char(_I2C_SLV4_ADDR, address)
+        self._register_char(_I2C_SLV4_REG, register)
+        self._register_char(_I2C_SLV4_DO, value)
+        self._register_char(_I2C_SLV4_CTRL, _SLV_EN)
+        self._aux_wait()
+
+    def aux_read(self, address, register):
+        """ Read one byte from register of the slave at address on the
+        auxiliary bus. """
+        self._register_char(_I2C_SLV4_ADDR, _SLV_READ | address)
+        self._register_char(_I2C_SLV4_REG, register)
+        self._register_char(_I2C_SLV4_CTRL, _SLV_EN)
+        self._aux_wait()
+        return self._register_char(_I2C_SLV4_DI)
+
+    def _aux_wait(self):
+        """ Wait for a SLV4 transfer, which happens at the next sample. Raises
+        OSError if the slave does not answer or it takes too long. """
+        timeout = 3 * self.sample_period_us // 1000 + 10
+        start = utime.ticks_ms()
+        while True:
+            status = self._register_char(_I2C_MST_STATUS)
+            if status & _SLV4_NACK:
+                raise OSError(19)       # ENODEV, as machine.I2C gives
+            if status & _SLV4_DONE:
+                return
+            if utime.ticks_diff(utime.ticks_ms(), start) > timeout:
+                raise OSError(110)      # ETIMEDOUT
+            utime.sleep_us(self.sample_period_us // 4 + 50)
+
+    @property
+    def accel_counts_per_g(self):
+        """ Raw accelerometer counts per g at the current range. """
+        return self._accel_so
+
+    def fifo_enable(self, sources=FIFO_ACCEL | FIFO_GYRO, frames=32):
+        """
+        Start streaming samples into the chip's FIFO. sources is a
+        combination of the FIFO_ values saying which sensors to store.
+        Each sample is stored as one frame of fifo_words raw int16 values, in
+        register order: accelerometer X, Y, Z, then temperature, then gyro
+        X, Y, Z, leaving out the ones not chosen. frames is the most frames
+        read_fifo() will drain in one call.
+        """
+        self.fifo_words = self._frame_words(sources)
+        self._fifo_buf = bytearray(2 * self.fifo_words * frames)
+        self.fifo_data = array("h", [0] * (self.fifo_words * frames))
+        self._register_char(_FIFO_EN, sources)
+        self.fifo_reset()
+
+    def fifo_disable(self):
+        """ Stop storing samples in the FIFO. """
+        self._register_char(_FIFO_EN, 0)
+        user_ctrl = self._register_char(_USER_CTRL)
+        self._register_char(_USER_CTRL, user_ctrl & ~_USER_FIFO_EN)
+
+    def fifo_reset(self):
+        """ Throw away whatever is in the FIFO and start filling it again. """
+        user_ctrl = self._register_char(_USER_CTRL) & ~_USER_FIFO_EN
+        self._register_char(_USER_CTRL, user_ctrl | _USER_FIFO_RESET)
+        self._register_char(_USER_CTRL, user_ctrl | _USER_FIFO_EN)
+
+    @property
+    def fifo_count(self):
+        """ Number of bytes waiting in the FIFO. """
+        return self._register_short(_FIFO_COUNTH)
+
+    def read_fifo(self, buf=None):
+        """
+        Read all the complete frames waiting in the FIFO, up to the number
+        given to fifo_enable(), in one I2C transfer and decode them into buf
+        (an array("h")), or into fifo_data if buf is not given. Returns the
+        number of frames read.
+
+        If the FIFO has overflowed the frames can no longer be told apart,
+        so it is emptied, fifo_overflows is counted up and 0 is returned.
+        Read often enough that it never fills: it holds 1024 bytes.
+        """
+        count = self.fifo_count
+        size = 2 * self.fifo_words
+        if count >= _FIFO_SIZE or count % size:
+            self.fifo_overflows += 1
+            self.fifo_reset()
+            return 0
+        frames = min(count // size, len(self._fifo_buf) // size)
+        if frames:
+            nbytes = frames * size
+            self.i2c.readfrom_mem_into(
+                self.address, _FIFO_R_W, memoryview(self._fifo_buf)[:nbytes]
+            )
+            _be16(self._fifo_buf, 0, self.fifo_data if buf is None else buf, 0, nbytes // 2)
+        return frames
+
+    @staticmethod
+    def _frame_words(sources):
+        words = 3 if sources & FIFO_ACCEL else 0
+        for bit in (FIFO_TEMP, FIFO_GYRO_X, FIFO_GYRO_Y, FIFO_GYRO_Z):
+            if sources & bit:
+                words += 1
+        return words
+
+    def _set_gyro_offset(self, offset):
+        """ Set the gyro bias from an offset in gyro units. """
+        for i in range(3):
+            self._gyro_bias[i] = round(offset[i] * self._gyro_so / self._gyro_sf)
+            self._gyro_slope[i] = 0
+        self._track_temp(self._temp, True)
 
-        while count:
-            utime.sleep_ms(delay)
-            gx, gy, gz = self.gyro
-            ox += gx
-            oy += gy
-            oz += gz
-            count -= 1
+    def _track_temp(self, temp, force=False):
+        """ Note the temperature and move the gyro bias with it. """
+        if temp == self._temp and not force:
+            return
+        self._temp = temp
+        dt = temp - self._cal_temp
+        for i in range(3):
+            self._bias[4 + i] = self._gyro_bias[i] + ((self._gyro_slope[i] * dt) >> 16)
 
-        self._gyro_offset = (ox / n, oy / n, oz / n)
-        return self._gyro_offset
+    def _read_raw(self):
+        """ Accel X, Y, Z, temperature and gyro X, Y, Z as raw int16s,
+        read in one transfer. """
+        self.i2c.readfrom_mem_into(self.address, _ACCEL_XOUT_H, self._raw_mv)
+        return ustruct.unpack_from(">7h", self._raw)
 
     def _register_short(self, register, value=None, buf=bytearray(2)):
         if value is None:
@@ -325,7 +1007,7 @@ class MPU6050:
             self.i2c.readfrom_mem_into(self.address, register, buf)
             return buf[0]
 
-        ustruct.pack_into("<b", buf, 0, value)
+        ustruct.pack_into("<B", buf, 0, value)
         return self.i2c.writeto_mem(self.address, register, buf)
 
     def _accel_fs(self, value):
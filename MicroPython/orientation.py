@@ -0,0 +1,184 @@
+# Orientation of Cya's body from the MPU6050
+#
+# Complementary gives pitch and roll, which is all balancing needs and is
+# cheap enough to run at a few hundred Hz. Madgwick keeps a quaternion
+# instead, so it also tracks yaw (which drifts, there being no magnetometer)
+# and does not misbehave near vertical.
+#
+# Both expect acceleration in any units and gyro rates in radians per
+# second, which is what mpu6050.MPU6050 gives by default. Feed them with
+# update() from values you already have, or let update_from() read the
+# MPU6050 and time the samples itself.
+#
+#   imu = mpu6050.MPU6050(i2c, rate=200)
+#   imu.wake
+#   tilt = orientation.Complementary()
+#   while True:
+#       tilt.update_from(imu)
+#       if abs(tilt.pitch) > 0.3:
+#           ...
+
+import math
+import micropython
+import utime
+from array import array
+from micropython import const
+
+# Positions in the array given to euler_into()
+ROLL = const(0)
+PITCH = const(1)
+YAW = const(2)
+
+
+@micropython.native
+def _complementary(angles, alpha, ax, ay, az, gx, gy, dt):
+    roll = math.atan2(ay, az)
+    pitch = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+    if dt <= 0:
+        angles[0] = roll
+        angles[1] = pitch
+    else:
+        angles[0] = alpha * (angles[0] + gx * dt) + (1 - alpha) * roll
+        angles[1] = alpha * (angles[1] + gy * dt) + (1 - alpha) * pitch
+
+
+@micropython.native
+def _madgwick(q, beta, ax, ay, az, gx, gy, gz, dt):
+    q0 = q[0]
+    q1 = q[1]
+    q2 = q[2]
+    q3 = q[3]
+
+    # Rate of change of the quaternion from the gyro
+    qd0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+    qd1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+    qd2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+    qd3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+    # Gradient descent step towards the gravity direction measured by the
+    # accelerometer, skipped when there is no reading (free fall)
+    norm = math.sqrt(ax * ax + ay * ay + az * az)
+    if norm > 0:
+        ax /= norm
+        ay /= norm
+        az /= norm
+        _2q0 = 2 * q0
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _4q0 = 4 * q0
+        _4q1 = 4 * q1
+        _4q2 = 4 * q2
+        _8q1 = 8 * q1
+        _8q2 = 8 * q2
+        q0q0 = q0 * q0
+        q1q1 = q1 * q1
+        q2q2 = q2 * q2
+        q3q3 = q3 * q3
+        s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+        s1 = _4q1 * q3q3 - _2q3 * ax + 4 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+        s2 = 4 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+        s3 = 4 * q1q1 * q3 - _2q1 * ax + 4 * q2q2 * q3 - _2q2 * ay
+        norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+        if norm > 0:
+            qd0 -= beta * s0 / norm
+            qd1 -= beta * s1 / norm
+            qd2 -= beta * s2 / norm
+            qd3 -= beta * s3 / norm
+
+    q0 += qd0 * dt
+    q1 += qd1 * dt
+    q2 += qd2 * dt
+    q3 += qd3 * dt
+    norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    q[0] = q0 / norm
+    q[1] = q1 / norm
+    q[2] = q2 / norm
+    q[3] = q3 / norm
+
+
+class _Filter:
+    """ What both filters share: reading and timing samples from an MPU6050. """
+    def __init__(self):
+        self._sample = array("f", [0.0] * 7)
+        self._last = None
+
+    def update_from(self, imu):
+        """
+        Read one sample from imu (an mpu6050.MPU6050) and update with it,
+        using the time since the previous update_from() as dt.
+        """
+        s = imu.read_into(self._sample)
+        now = utime.ticks_us()
+        dt = 0.0
+        if self._last is not None:
+            dt = utime.ticks_diff(now, self._last) / 1000000
+        self._last = now
+        self.update(s[0], s[1], s[2], s[4], s[5], s[6], dt)
+
+    def reset(self):
+        """ Forget the current estimate; the next update starts afresh. """
+        self._last = None
+
+
+class Complementary(_Filter):
+    """
+    Pitch and roll in radians. Each update trusts the integrated gyro rate
+    by alpha and the accelerometer's idea of down by 1 - alpha: closer to 1
+    is smoother but slower to correct gyro drift.
+    """
+    def __init__(self, alpha=0.98):
+        super().__init__()
+        self.alpha = alpha
+        self.angles = array("f", [0.0, 0.0])   # roll, pitch
+        self._started = False
+
+    def update(self, ax, ay, az, gx, gy, gz, dt):
+        """ Add one sample taken dt seconds after the previous one. """
+        if not self._started:
+            dt = 0.0
+            self._started = True
+        _complementary(self.angles, self.alpha, ax, ay, az, gx, gy, dt)
+
+    def reset(self):
+        super().reset()
+        self._started = False
+
+    @property
+    def roll(self):
+        return self.angles[0]
+
+    @property
+    def pitch(self):
+        return self.angles[1]
+
+
+class Madgwick(_Filter):
+    """
+    Orientation as a quaternion (w, x, y, z) using Madgwick's gradient
+    descent filter. beta is how hard the accelerometer pulls the estimate
+    back towards down each second; larger corrects gyro drift faster but
+    lets more vibration through.
+    """
+    def __init__(self, beta=0.1):
+        super().__init__()
+        self.beta = beta
+        self.q = array("f", [1.0, 0.0, 0.0, 0.0])
+
+    def update(self, ax, ay, az, gx, gy, gz, dt):
+        """ Add one sample taken dt seconds after the previous one. """
+        _madgwick(self.q, self.beta, ax, ay, az, gx, gy, gz, dt)
+
+    def reset(self):
+        super().reset()
+        self.q[0] = 1.0
+        self.q[1] = self.q[2] = self.q[3] = 0.0
+
+    def euler_into(self, buf):
+        """ Store roll, pitch and yaw in radians in buf. Returns buf. """
+        w, x, y, z = self.q
+        buf[ROLL] = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+        sinp = 2 * (w * y - z * x)
+        buf[PITCH] = math.asin(max(-1.0, min(1.0, sinp)))
+        buf[YAW] = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+        return buf
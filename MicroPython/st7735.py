@@ -7,10 +7,18 @@
 # Doug Kimber
 # Merged in load_bmp() method to display .bmp files
 # Added use of const() to reduce RAM requirements
+# Added an optional off-screen frame buffer (buffered()/show())
+# show() only sends the regions drawn since the last show()
+# Opaque characters are rendered once into a glyph cache and blitted
+# Opaque text is composed a line at a time and sent as one block
+# load_bmp() streams whole rows instead of reading and sending pixels singly
+# blit_file() draws pre-converted .565 images (see tools/img2rgb565.py)
+# Command, window and fill writes use preallocated buffers only
 #
 
 import machine
 import time
+import framebuf
 from math import sqrt
 
 #TFTRotations and TFTRGB are bits to set
@@ -30,6 +38,19 @@ TFTRotations = [ 0x00, 0x60, 0xC0, 0xA0]
 TFTBGR = const(0x08) # for 1.8 and 1.44 inch display
 TFTRGB = const(0x00)
 
+_MAXDIRTY = const(4) # Number of dirty rectangles tracked before merging.
+_ROWBATCH = const(2048) # Bytes of image rows sent per SPI write.
+_FILLBYTES = const(2048) # Bytes of one color sent per SPI write by _draw().
+
+#.565 image files: a 12 byte header of b'R565', version, flags and little
+# endian 16 bit width, height and frame count, then the frames one after
+# another, each height rows of width big endian 565 pixels.  With _565RLE
+# set the header is followed by a 32 bit file offset for each frame and
+# each row is run length encoded: a control byte c < 0x80 is followed by
+# c + 1 literal pixels, otherwise the next pixel repeats (c & 0x7F) + 1 times.
+_565HDR = const(12)
+_565RLE = const(0x01)
+
 #@micropython.native
 def clamp( aValue, aMin, aMax ) :
   return max(aMin, min(aMax, aValue))
@@ -40,8 +61,163 @@ def TFTColor( aR, aG, aB ) :
      This assumes rgb 565 layout and will be incorrect for bgr.'''
   return ((aR & 0xF8) << 8) | ((aG & 0xFC) << 3) | (aB >> 3)
 
+@micropython.native
+def _swap565( aColor ) :
+  '''framebuf stores RGB565 little endian but the display wants big endian,
+     so colors are byte swapped on the way into the frame buffer.'''
+  return ((aColor & 0xFF) << 8) | ((aColor >> 8) & 0xFF)
+
+@micropython.native
+def _bgr565( aSrc, aDst, aStart, aPixels ) :
+  '''Convert aPixels BGR888 pixels from aSrc into big endian 565 in aDst,
+     beginning at byte aStart.'''
+  s = 0
+  d = aStart
+  for i in range(aPixels) :
+    g = aSrc[s + 1]
+    aDst[d] = (aSrc[s + 2] & 0xF8) | (g >> 5)
+    aDst[d + 1] = ((g & 0x1C) << 3) | (aSrc[s] >> 3)
+    s += 3
+    d += 2
+
+@micropython.native
+def _unrle( aSrc, aSi, aDst, aBytes ) :
+  '''Decode one run length encoded row of aBytes bytes from memoryview aSrc,
+     beginning at aSi, into memoryview aDst.  Returns the index in aSrc just
+     past the row.'''
+  d = 0
+  while d < aBytes :
+    c = aSrc[aSi]
+    aSi += 1
+    if c & 0x80 :
+      hi = aSrc[aSi]
+      lo = aSrc[aSi + 1]
+      aSi += 2
+      for i in range((c & 0x7F) + 1) :
+        aDst[d] = hi
+        aDst[d + 1] = lo
+        d += 2
+    else :
+      n = (c + 1) * 2
+      aDst[d:d + n] = aSrc[aSi:aSi + n]
+      aSi += n
+      d += n
+  return aSi
+
+def read565header( f ) :
+  '''Read the header of an open .565 file.  Returns
+     (width, height, frames, flags).'''
+  hdr = f.read(_565HDR)
+  if len(hdr) != _565HDR or hdr[0:4] != b'R565' or hdr[4] != 1 :
+    raise ValueError("Not a .565 image")
+  return (hdr[6] | (hdr[7] << 8), hdr[8] | (hdr[9] << 8),
+          hdr[10] | (hdr[11] << 8), hdr[5])
+
+def load565( filename ) :
+  '''Read every frame of a .565 file into RAM.  Returns
+     (width, height, frames) where frames is a list of bytearrays.'''
+  with open(filename, 'rb') as f :
+    width, height, count, flags = read565header(f)
+    rowbytes = width * 2
+    frames = []
+    if flags & _565RLE :
+      f.seek(_565HDR + count * 4)
+      data = memoryview(f.read())
+      si = 0
+      for i in range(count) :
+        frame = bytearray(rowbytes * height)
+        fv = memoryview(frame)
+        for r in range(height) :
+          si = _unrle(data, si, fv[r * rowbytes:], rowbytes)
+        frames.append(frame)
+    else :
+      for i in range(count) :
+        frame = bytearray(rowbytes * height)
+        f.readinto(frame)
+        frames.append(frame)
+  return width, height, frames
+
+@micropython.native
+def _fill565( aBuf, aStart, aEnd, aColor ) :
+  '''Store aColor big endian in aBuf from byte aStart up to aEnd.'''
+  hi = (aColor >> 8) & 0xFF
+  lo = aColor & 0xFF
+  for i in range(aStart, aEnd, 2) :
+    aBuf[i] = hi
+    aBuf[i + 1] = lo
+
 #ScreenSize = (128, 160)
 
+class GlyphCache(object) :
+  '''Least recently used cache of characters rendered into blocks of big
+     endian 565 pixels, ready to be sent to the display in one write.
+     aBudget is the most bytes of rendered glyphs kept at once.'''
+
+  def __init__( self, aBudget = 2048 ) :
+    self.budget = aBudget
+    self.used = 0
+    self.hits = 0
+    self.misses = 0
+    self._glyphs = {}                   #key: [data, last use]
+    self._clock = 0
+
+  def clear( self ) :
+    self._glyphs.clear()
+    self.used = 0
+
+  def get( self, aFont, aIndex, aColor, aBgColor, aSX, aSY ) :
+    '''Return the block for font data offset aIndex drawn aColor on aBgColor
+       and scaled aSX, aSY.  The block is aSX * Width wide and
+       aSY * Height high.'''
+    self._clock += 1
+    key = (id(aFont), aIndex, aColor, aBgColor, aSX, aSY)
+    entry = self._glyphs.get(key)
+    if entry is not None :
+      self.hits += 1
+      entry[1] = self._clock
+      return entry[0]
+
+    self.misses += 1
+    data = self._render(aFont, aIndex, aColor, aBgColor, aSX, aSY)
+    size = len(data)
+    if size > self.budget :
+      return data
+    while self.used + size > self.budget :
+      oldest = None
+      age = self._clock
+      for k in self._glyphs :
+        if self._glyphs[k][1] < age :
+          oldest = k
+          age = self._glyphs[k][1]
+      self.used -= len(self._glyphs.pop(oldest)[0])
+    self._glyphs[key] = [data, self._clock]
+    self.used += size
+    return data
+
+  @staticmethod
+  def _render( aFont, aIndex, aColor, aBgColor, aSX, aSY ) :
+    fontw = aFont['Width']
+    fonth = aFont['Height']
+    font = aFont['Data']
+    w = fontw * aSX
+    data = bytearray(w * fonth * aSY * 2)
+    fh = (aColor >> 8) & 0xFF
+    fl = aColor & 0xFF
+    bh = (aBgColor >> 8) & 0xFF
+    bl = aBgColor & 0xFF
+    i = 0
+    for r in range(fonth * aSY) :
+      bit = 1 << (r // aSY)
+      for c in range(w) :
+        if font[aIndex + c // aSX] & bit :
+          data[i] = fh
+          data[i + 1] = fl
+        else :
+          data[i] = bh
+          data[i + 1] = bl
+        i += 2
+    return data
+
 class TFT(object) :
   """ define different model of ST7735, circuit board color or types (tabcolor)."""
   GREENTAB        = const(0x0) # 128x160 , start col 2, start row 1, rgb
@@ -143,6 +319,27 @@ class TFT(object) :
     self.spi = spi
     self.colorData = bytearray(2)
     self.windowLocData = bytearray(4)
+    self._cmd = bytearray(1)
+    self._arg = bytearray(1)
+    #_draw() sends runs of one color from _fillbuf, which holds _fillvalid
+    # bytes of _fillcolor.  _fillviews[k] is the first 2 << k bytes of it so
+    # any length can be sent without slicing.
+    self._fillbuf = bytearray(_FILLBYTES)
+    mv = memoryview(self._fillbuf)
+    self._fillviews = []
+    n = 2
+    while n < _FILLBYTES :
+      self._fillviews.append(mv[:n])
+      n <<= 1
+    self._fillcolor = -1
+    self._fillvalid = 0
+    self._fbuf = None                   #Off-screen frame buffer, see buffered().
+    self._fbmv = None
+    self._fb = None
+    self._dirty = [0] * (4 * _MAXDIRTY) #x0, y0, x1, y1 (exclusive) per rect.
+    self._ndirty = 0
+    self._glyphs = GlyphCache()
+    self._linebuf = None                #Scratch for composing opaque text.
 
 
   def cs (self, iologic) :
@@ -155,6 +352,85 @@ class TFT(object) :
   def offset ( self ) :
     return self._offset
 
+  def buffered( self, aTF = True ) :
+    '''True = draw into an off-screen RGB565 frame buffer in RAM.  Nothing is
+       sent to the display until show() is called.  False = draw directly to
+       the display and release the buffer.'''
+    if aTF :
+      nbytes = self._size[0] * self._size[1] * 2
+      if self._fbuf is None or len(self._fbuf) != nbytes :
+        self._fbuf = None
+        self._fbuf = bytearray(nbytes)
+        self._fbmv = memoryview(self._fbuf)
+      self._fb = framebuf.FrameBuffer(self._fbuf, self._size[0], self._size[1], framebuf.RGB565)
+      self._ndirty = 0
+      self._mark(0, 0, self._size[0], self._size[1])
+    else :
+      self._fb = None
+      self._fbmv = None
+      self._fbuf = None
+
+  def glyphcache( self, aBudget ) :
+    '''Set the number of bytes of rendered characters to keep for opaque
+       text.  0 turns caching off.'''
+    self._glyphs.clear()
+    self._glyphs.budget = aBudget
+
+  def isbuffered( self ) :
+    return self._fb is not None
+
+  def show( self, aAll = False ) :
+    '''Send the parts of the frame buffer drawn since the last show() to
+       the display.  aAll = True resends the whole frame.'''
+    if self._fb is None :
+      return
+    if aAll :
+      self._ndirty = 0
+      self._mark(0, 0, self._size[0], self._size[1])
+    stride = self._size[0] * 2
+    d = self._dirty
+    for i in range(0, self._ndirty * 4, 4) :
+      self._writerect(self._fbmv, d[i + 1] * stride + d[i] * 2, stride,
+                      d[i], d[i + 1], d[i + 2], d[i + 3])
+    self._ndirty = 0
+
+  def _mark( self, aX, aY, aW, aH ) :
+    '''Record that aW x aH pixels at aX, aY of the frame buffer changed.
+       Overlapping or touching rectangles are merged.  When the list is full
+       the rectangle is merged into whichever entry grows the least.'''
+    x0 = max(aX, 0)
+    y0 = max(aY, 0)
+    x1 = min(aX + aW, self._size[0])
+    y1 = min(aY + aH, self._size[1])
+    if x1 <= x0 or y1 <= y0 :
+      return
+    d = self._dirty
+    n = self._ndirty * 4
+    best = -1
+    for i in range(0, n, 4) :
+      if x0 <= d[i + 2] and d[i] <= x1 and y0 <= d[i + 3] and d[i + 1] <= y1 :
+        best = i
+        break
+    if best < 0 :
+      if n < len(d) :
+        d[n] = x0
+        d[n + 1] = y0
+        d[n + 2] = x1
+        d[n + 3] = y1
+        self._ndirty += 1
+        return
+      grow = 0
+      for i in range(0, n, 4) :
+        g = ((max(x1, d[i + 2]) - min(x0, d[i])) * (max(y1, d[i + 3]) - min(y0, d[i + 1]))
+             - (d[i + 2] - d[i]) * (d[i + 3] - d[i + 1]))
+        if best < 0 or g < grow :
+          best = i
+          grow = g
+    if x0 < d[best] : d[best] = x0
+    if y0 < d[best + 1] : d[best + 1] = y0
+    if x1 > d[best + 2] : d[best + 2] = x1
+    if y1 > d[best + 3] : d[best + 3] = y1
+
 #   @micropython.native
   def on( self, aTF = True ) :
     '''Turn display on or off.'''
@@ -184,6 +460,10 @@ class TFT(object) :
     if (rotchange & 1):
       self._size =(self._size[1], self._size[0])
       self._offset=(self._offset[1], self._offset[0])
+      if self._fb is not None :
+        self._fb = framebuf.FrameBuffer(self._fbuf, self._size[0], self._size[1], framebuf.RGB565)
+        self._ndirty = 0
+        self._mark(0, 0, self._size[0], self._size[1])
 
     if self.tabcolor == self.GREENTAB128x128 :
       # special handling of 128x128 with different offsets during rotations
@@ -201,15 +481,22 @@ class TFT(object) :
   def pixel( self, aPos, aColor ) :
     '''Draw a pixel at the given position'''
     if 0 <= aPos[0] < self._size[0] and 0 <= aPos[1] < self._size[1]:
+      if self._fb is not None :
+        x, y = int(aPos[0]), int(aPos[1])
+        self._fb.pixel(x, y, _swap565(aColor))
+        self._mark(x, y, 1, 1)
+        return
       self._setwindowpoint(aPos)
       self._pushcolor(aColor)
 
 #   @micropython.native
-  def text( self, aPos, aString, aColor, aFont, aSize = 1, nowrap = False ) :
+  def text( self, aPos, aString, aColor, aFont, aSize = 1, nowrap = False, aBgColor = None ) :
     '''Draw a text at the given position.  If the string reaches the end of the
        display it is wrapped to aPos[0] on the next line.  aSize may be an integer
        which will size the font uniformly on w,h or a or any type that may be
-       indexed with [0] or [1].'''
+       indexed with [0] or [1].  If aBgColor is given the text is drawn
+       opaque on that color, including the gaps between characters, and
+       each line is sent to the display as a single block.'''
 
     if aFont == None:
       return
@@ -222,8 +509,23 @@ class TFT(object) :
 
     px, py = aPos
     width = wh[0] * aFont["Width"] + 1
+    if aBgColor is not None :
+      start = 0
+      for i in range(len(aString)) :
+        px += width
+        if px + width > self._size[0]:
+          self._textline(aPos[0], py, aString, start, i + 1, aColor, aBgColor, aFont, wh)
+          if nowrap:
+            return
+          start = i + 1
+          py += aFont["Height"] * wh[1] + 1
+          px = aPos[0]
+      if start < len(aString) :
+        self._textline(aPos[0], py, aString, start, len(aString), aColor, aBgColor, aFont, wh)
+      return
+
     for c in aString:
-      self.char((px, py), c, aColor, aFont, wh)
+      self.char((px, py), c, aColor, aFont, wh, aBgColor)
       px += width
       #We check > rather than >= to let the right (blank) edge of the
       # character print off the right of the screen.
@@ -234,11 +536,67 @@ class TFT(object) :
           py += aFont["Height"] * wh[1] + 1
           px = aPos[0]
 
+  def textwidth( self, aString, aFont, aSize = 1 ) :
+    '''Width in pixels of aString drawn on one line by text().'''
+    if aFont == None or not aString :
+      return 0
+    if (type(aSize) == int) or (type(aSize) == float):
+      sw = aSize
+    else:
+      sw = aSize[0]
+    return len(aString) * (sw * aFont["Width"] + 1) - 1
+
+  def _textline( self, aX, aY, aString, aStart, aEnd, aColor, aBgColor, aFont, aSizes ) :
+    '''Compose characters aStart up to aEnd of aString, with the gaps
+       between them, into one block of pixels and draw it at aX, aY.'''
+    fontw = aFont['Width']
+    startchar = aFont['Start']
+    endchar = aFont['End']
+    sx = max(int(aSizes[0]), 1)
+    sy = max(int(aSizes[1]), 1)
+    cw = fontw * sx * 2                 #Bytes per character row.
+    w = (aEnd - aStart) * (fontw * sx + 1) - 1
+    h = aFont['Height'] * sy
+    stride = w * 2
+    if self._linebuf is None or len(self._linebuf) < stride * h :
+      self._linebuf = None
+      self._linebuf = bytearray(stride * h)
+    buf = memoryview(self._linebuf)
+    bh = (aBgColor >> 8) & 0xFF
+    bl = aBgColor & 0xFF
+
+    x = 0
+    for i in range(aStart, aEnd) :
+      ci = ord(aString[i])
+      if startchar <= ci <= endchar :
+        glyph = memoryview(self._glyphs.get(aFont, (ci - startchar) * fontw, aColor, aBgColor, sx, sy))
+        s = 0
+        d = x
+        for r in range(h) :
+          buf[d:d + cw] = glyph[s:s + cw]
+          s += cw
+          d += stride
+      else :
+        for d in range(x, stride * h, stride) :
+          for c in range(d, d + cw, 2) :
+            buf[c] = bh
+            buf[c + 1] = bl
+      x += cw
+      if x < stride :
+        #Gap column between characters.
+        for d in range(x, stride * h, stride) :
+          buf[d] = bh
+          buf[d + 1] = bl
+        x += 2
+    self._blit(aX, aY, w, h, buf)
+
 #   @micropython.native
-  def char( self, aPos, aChar, aColor, aFont, aSizes ) :
+  def char( self, aPos, aChar, aColor, aFont, aSizes, aBgColor = None ) :
     '''Draw a character at the given position using the given font and color.
        aSizes is a tuple with x, y as integer scales indicating the
-       # of pixels to draw for each pixel in the character.'''
+       # of pixels to draw for each pixel in the character.  If aBgColor is
+       given the whole character cell is drawn, using a cached rendering of
+       the character so it takes a single write.'''
 
     if aFont == None:
       return
@@ -252,6 +610,13 @@ class TFT(object) :
       fonth = aFont['Height']
       ci = (ci - startchar) * fontw
 
+      if aBgColor is not None :
+        sx = max(int(aSizes[0]), 1)
+        sy = max(int(aSizes[1]), 1)
+        data = self._glyphs.get(aFont, ci, aColor, aBgColor, sx, sy)
+        self._blit(aPos[0], aPos[1], fontw * sx, fonth * sy, data)
+        return
+
       charA = aFont["Data"][ci:ci + fontw]
       px = aPos[0]
       if aSizes[0] <= 1 and aSizes[1] <= 1 :
@@ -293,54 +658,62 @@ class TFT(object) :
       inx = 1 if dx > 0 else -1
       iny = 1 if dy > 0 else -1
 
+      #Points on the same row (or column, for steep lines) are
+      # collected into runs and each run is drawn as one span.
       dx = abs(dx)
       dy = abs(dy)
       if (dx >= dy):
         dy <<= 1
         e = dy - dx
         dx <<= 1
+        rx = px
         while (px != ex):
-          self.pixel((px, py), aColor)
           if (e >= 0):
+            self._span(min(rx, px), py, abs(px - rx) + 1, 1, aColor)
+            rx = px + inx
             py += iny
             e -= dx
           e += dy
           px += inx
+        if rx != px:
+          px -= inx
+          self._span(min(rx, px), py, abs(px - rx) + 1, 1, aColor)
       else:
         dx <<= 1
         e = dx - dy
         dy <<= 1
+        ry = py
         while (py != ey):
-          self.pixel((px, py), aColor)
           if (e >= 0):
+            self._span(px, min(ry, py), 1, abs(py - ry) + 1, aColor)
+            ry = py + iny
             px += inx
             e -= dy
           e += dx
           py += iny
+        if ry != py:
+          py -= iny
+          self._span(px, min(ry, py), 1, abs(py - ry) + 1, aColor)
 
 #   @micropython.native
   def vline( self, aStart, aLen, aColor ) :
     '''Draw a vertical line from aStart for aLen. aLen may be negative.'''
-    start = (clamp(aStart[0], 0, self._size[0]), clamp(aStart[1], 0, self._size[1]))
-    stop = (start[0], clamp(start[1] + aLen, 0, self._size[1]))
-    #Make sure smallest y 1st.
-    if (stop[1] < start[1]):
-      start, stop = stop, start
-    self._setwindowloc(start, stop)
-    self._setColor(aColor)
-    self._draw(aLen)
+    y = int(aStart[1])
+    aLen = int(aLen)
+    if aLen < 0 :
+      y += aLen
+      aLen = -aLen
+    self._span(int(aStart[0]), y, 1, aLen, aColor)
 
 #   @micropython.native
   def hline( self, aStart, aLen, aColor ) :
     '''Draw a horizontal line from aStart for aLen. aLen may be negative.'''
-    start = (clamp(aStart[0], 0, self._size[0]), clamp(aStart[1], 0, self._size[1]))
-    stop = (clamp(start[0] + aLen, 0, self._size[0]), start[1])
-    #Make sure smallest x 1st.
-    if (stop[0] < start[0]):
-      start, stop = stop, start
-    self._setwindowloc(start, stop)
-    self._setColor(aColor)
-    self._draw(aLen)
+    x = int(aStart[0])
+    aLen = int(aLen)
+    if aLen < 0 :
+      x += aLen
+      aLen = -aLen
+    self._span(x, int(aStart[1]), aLen, 1, aColor)
 
 #   @micropython.native
   def rect( self, aStart, aSize, aColor ) :
@@ -355,98 +728,178 @@ class TFT(object) :
   def fillrect( self, aStart, aSize, aColor ) :
     '''Draw a filled rectangle.  aStart is the smallest coordinate corner
        and aSize is a tuple indicating width, height.'''
-    start = (clamp(aStart[0], 0, self._size[0]), clamp(aStart[1], 0, self._size[1]))
-    end = (clamp(start[0] + aSize[0] - 1, 0, self._size[0]), clamp(start[1] + aSize[1] - 1, 0, self._size[1]))
-
-    if (end[0] < start[0]):
-      tmp = end[0]
-      end = (start[0], end[1])
-      start = (tmp, start[1])
-    if (end[1] < start[1]):
-      tmp = end[1]
-      end = (end[0], start[1])
-      start = (start[0], tmp)
-
-    self._setwindowloc(start, end)
-    numPixels = (end[0] - start[0] + 1) * (end[1] - start[1] + 1)
-    self._setColor(aColor)
-    self._draw(numPixels)
+    x, y = int(aStart[0]), int(aStart[1])
+    w, h = int(aSize[0]), int(aSize[1])
+    if w < 0 :
+      x += w + 1
+      w = -w
+    if h < 0 :
+      y += h + 1
+      h = -h
+    self._span(x, y, w, h, aColor)
 
 #   @micropython.native
   def circle( self, aPos, aRadius, aColor ) :
-    '''Draw a hollow circle with the given radius and color with aPos as center.'''
-    self.colorData[0] = aColor >> 8
-    self.colorData[1] = aColor
+    '''Draw a hollow circle with the given radius and color with aPos as center.
+       Neighbouring points on the same row or column are drawn together
+       as one span.'''
+    cx, cy = int(aPos[0]), int(aPos[1])
     xend = int(0.7071 * aRadius) + 1
     rsq = aRadius * aRadius
-    for x in range(xend) :
-      y = int(sqrt(rsq - x * x))
-      xp = aPos[0] + x
-      yp = aPos[1] + y
-      xn = aPos[0] - x
-      yn = aPos[1] - y
-      xyp = aPos[0] + y
-      yxp = aPos[1] + x
-      xyn = aPos[0] - y
-      yxn = aPos[1] - x
-
-      self._setwindowpoint((xp, yp))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xp, yn))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xn, yp))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xn, yn))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xyp, yxp))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xyp, yxn))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xyn, yxp))
-      self._writedata(self.colorData)
-      self._setwindowpoint((xyn, yxn))
-      self._writedata(self.colorData)
+    x = 0
+    y = int(sqrt(rsq))
+    while x < xend :
+      #Find the run of x that share this y.
+      run = x + 1
+      ny = y
+      while run < xend :
+        ny = int(sqrt(rsq - run * run))
+        if ny != y :
+          break
+        run += 1
+      n = run - x
+      ln = n if x else n - 1            #Column cx is drawn by the right side.
+      #Top and bottom octants are horizontal runs.
+      self._span(cx + x, cy + y, n, 1, aColor)
+      self._span(cx + x, cy - y, n, 1, aColor)
+      self._span(cx - run + 1, cy + y, ln, 1, aColor)
+      self._span(cx - run + 1, cy - y, ln, 1, aColor)
+      #Left and right octants are vertical runs.
+      self._span(cx + y, cy + x, 1, n, aColor)
+      self._span(cx - y, cy + x, 1, n, aColor)
+      self._span(cx + y, cy - run + 1, 1, ln, aColor)
+      self._span(cx - y, cy - run + 1, 1, ln, aColor)
+      x = run
+      y = ny
 
 #   @micropython.native
   def fillcircle( self, aPos, aRadius, aColor ) :
-    '''Draw a filled circle with given radius and color with aPos as center'''
+    '''Draw a filled circle with given radius and color with aPos as center.
+       Neighbouring columns of the same height are drawn together as one
+       rectangle.'''
+    cx, cy = int(aPos[0]), int(aPos[1])
     rsq = aRadius * aRadius
-    for x in range(aRadius) :
-      y = int(sqrt(rsq - x * x))
-      y0 = aPos[1] - y
-      ey = y0 + y * 2
-      y0 = clamp(y0, 0, self._size[1])
-      ln = abs(ey - y0) + 1;
-
-      self.vline((aPos[0] + x, y0), ln, aColor)
-      self.vline((aPos[0] - x, y0), ln, aColor)
+    x = 0
+    y = int(sqrt(rsq))
+    while x < aRadius :
+      run = x + 1
+      ny = y
+      while run < aRadius :
+        ny = int(sqrt(rsq - run * run))
+        if ny != y :
+          break
+        run += 1
+      n = run - x
+      self._span(cx + x, cy - y, n, y * 2 + 1, aColor)
+      self._span(cx - run + 1, cy - y, n if x else n - 1, y * 2 + 1, aColor)
+      x = run
+      y = ny
+
+  def _span( self, aX, aY, aW, aH, aColor ) :
+    '''Fill the aW x aH rectangle at aX, aY with aColor using one window,
+       clipped to the screen.'''
+    x0 = max(aX, 0)
+    y0 = max(aY, 0)
+    x1 = min(aX + aW, self._size[0])
+    y1 = min(aY + aH, self._size[1])
+    if x1 <= x0 or y1 <= y0 :
+      return
+    if self._fb is not None :
+      self._fb.fill_rect(x0, y0, x1 - x0, y1 - y0, _swap565(aColor))
+      self._mark(x0, y0, x1 - x0, y1 - y0)
+      return
+    self._window(x0, y0, x1 - 1, y1 - 1)
+    self._setColor(aColor)
+    self._draw((x1 - x0) * (y1 - y0))
 
   def fill( self, aColor = BLACK ) :
     '''Fill screen with the given color.'''
     self.fillrect((0, 0), self._size, aColor)
 
   def image( self, x0, y0, x1, y1, data ) :
-    self._setwindowloc((x0, y0), (x1, y1))
-    self._writedata(data)
+    '''Draw big endian 565 pixel data into the rectangle x0,y0 - x1,y1
+       (inclusive).  The rectangle is clipped to the screen.'''
+    self._blit(x0, y0, x1 - x0 + 1, y1 - y0 + 1, data)
+
+  def subimage( self, aX, aY, aData, aDataW, aSrcX, aSrcY, aW, aH ) :
+    '''Draw the aW x aH piece at aSrcX, aSrcY of an image aDataW pixels wide
+       held in aData (big endian 565 pixels) with its corner at aX, aY.'''
+    self._blit(aX, aY, aW, aH, aData, aDataW * 2, (aSrcY * aDataW + aSrcX) * 2)
+
+  def _blit( self, aX, aY, aW, aH, aData, aStride = 0, aStart = 0 ) :
+    '''Copy aW x aH big endian 565 pixels from aData to aX, aY.  Anything
+       off the screen is clipped.  Rows of aData are aStride bytes apart
+       (default aW * 2), the first beginning at byte aStart.'''
+    aX, aY, aW, aH = int(aX), int(aY), int(aW), int(aH)
+    x0 = max(aX, 0)
+    y0 = max(aY, 0)
+    x1 = min(aX + aW, self._size[0])
+    y1 = min(aY + aH, self._size[1])
+    if x1 <= x0 or y1 <= y0 :
+      return
+    src = memoryview(aData)
+    stride = aStride or aW * 2
+    n = (x1 - x0) * 2
+    s = aStart + (y0 - aY) * stride + (x0 - aX) * 2
+    if self._fb is not None :
+      fbstride = self._size[0] * 2
+      d = y0 * fbstride + x0 * 2
+      dst = self._fbmv
+      for r in range(y1 - y0) :
+        dst[d:d + n] = src[s:s + n]
+        d += fbstride
+        s += stride
+      self._mark(x0, y0, x1 - x0, y1 - y0)
+      return
+    self._writerect(src, s, stride, x0, y0, x1, y1)
+
+  def _writerect( self, aSrc, aStart, aStride, x0, y0, x1, y1 ) :
+    '''Send the rectangle x0, y0 - x1, y1 (exclusive) to the display.  Its
+       rows are read from memoryview aSrc beginning at byte aStart and
+       aStride bytes apart.  All rows go out under a single CS assertion.'''
+    n = (x1 - x0) * 2
+    self._window(x0, y0, x1 - 1, y1 - 1)
+    if n == aStride :
+      #Whole rows are sent so the data is contiguous.
+      self._writedata(aSrc[aStart:aStart + n * (y1 - y0)])
+    else :
+      self.dc(1)
+      self.cs(0)
+      for r in range(y1 - y0) :
+        self.spi.write(aSrc[aStart:aStart + n])
+        aStart += aStride
+      self.cs(1)
 
 #   @micropython.native
   def _setColor( self, aColor ) :
-    self.colorData[0] = aColor >> 8
-    self.colorData[1] = aColor
-    self.buf = bytes(self.colorData) * 32
+    '''Set the color for _draw().  The fill buffer is only refilled, as
+       far as needed, when the color changes.'''
+    if aColor != self._fillcolor :
+      self._fillcolor = aColor
+      self._fillvalid = 0
 
 #   @micropython.native
   def _draw( self, aPixels ) :
     '''Send given color to the device aPixels times.'''
+    n = int(aPixels) * 2
+    if n <= 0 :
+      return
+    fill = min(n, _FILLBYTES)
+    if self._fillvalid < fill :
+      _fill565(self._fillbuf, self._fillvalid, fill, self._fillcolor)
+      self._fillvalid = fill
 
     self.dc(1)
     self.cs(0)
-    for i in range(aPixels//32):
-      self.spi.write(self.buf)
-    rest = (int(aPixels) % 32)
-    if rest > 0:
-        buf2 = bytes(self.colorData) * rest
-        self.spi.write(buf2)
+    for i in range(n // _FILLBYTES):
+      self.spi.write(self._fillbuf)
+    rest = n % _FILLBYTES
+    k = 0
+    while rest :
+      if rest & (2 << k) :
+        self.spi.write(self._fillviews[k])
+        rest -= 2 << k
+      k += 1
     self.cs(1)
 
 #   @micropython.native
@@ -472,18 +925,23 @@ class TFT(object) :
 #   @micropython.native
   def _setwindowloc( self, aPos0, aPos1 ) :
     '''Set a rectangular area for drawing a color to.'''
+    self._window(int(aPos0[0]), int(aPos0[1]), int(aPos1[0]), int(aPos1[1]))
+
+#   @micropython.native
+  def _window( self, x0, y0, x1, y1 ) :
+    '''_setwindowloc() for x0, y0 - x1, y1 (inclusive) without tuples.'''
     self._writecommand(TFT.CASET)            #Column address set.
     self.windowLocData[0] = self._offset[0]
-    self.windowLocData[1] = self._offset[0] + int(aPos0[0])
+    self.windowLocData[1] = self._offset[0] + x0
     self.windowLocData[2] = self._offset[0]
-    self.windowLocData[3] = self._offset[0] + int(aPos1[0])
+    self.windowLocData[3] = self._offset[0] + x1
     self._writedata(self.windowLocData)
 
     self._writecommand(TFT.RASET)            #Row address set.
     self.windowLocData[0] = self._offset[1]
-    self.windowLocData[1] = self._offset[1] + int(aPos0[1])
+    self.windowLocData[1] = self._offset[1] + y0
     self.windowLocData[2] = self._offset[1]
-    self.windowLocData[3] = self._offset[1] + int(aPos1[1])
+    self.windowLocData[3] = self._offset[1] + y1
     self._writedata(self.windowLocData)
 
     self._writecommand(TFT.RAMWR)            #Write to RAM.
@@ -493,7 +951,8 @@ class TFT(object) :
     '''Write given command to the device.'''
     self.dc(0)
     self.cs(0)
-    self.spi.write(bytearray([aCommand]))
+    self._cmd[0] = aCommand
+    self.spi.write(self._cmd)
     self.cs(1)
 
   @micropython.native
@@ -509,7 +968,7 @@ class TFT(object) :
   def _pushcolor( self, aColor ) :
     '''Push given color to the device.'''
     self.colorData[0] = aColor >> 8
-    self.colorData[1] = aColor
+    self.colorData[1] = aColor & 0xFF
     self._writedata(self.colorData)
 
   #@micropython.native
@@ -517,7 +976,8 @@ class TFT(object) :
     '''Set screen rotation and RGB/BGR format.'''
     self._writecommand(TFT.MADCTL)
     rgb = TFTRGB if self._rgb else TFTBGR
-    self._writedata(bytearray([TFTRotations[self.rotate] | rgb]))
+    self._arg[0] = TFTRotations[self.rotate] | rgb
+    self._writedata(self._arg)
 
   #@micropython.native
   def _reset( self ) :
@@ -755,37 +1215,134 @@ class TFT(object) :
         self.cs(1)
 
   # Load a .bmp at (aX,aY). Clips the image if it won't fit completely on the display.
+  # Whole rows are read into a reusable buffer, converted to 565 in one pass
+  # and sent to the display several rows per SPI write.
   @micropython.native
   def load_bmp( self, filename, aX=0, aY=0 ) :
-  	f=open( filename, 'rb')
-  	if f.read(2) == b'BM':  #header
-  		dummy = f.read(8) #file size(4), creator bytes(4)
-  		offset = int.from_bytes(f.read(4), 'little')
-  		hdrsize = int.from_bytes(f.read(4), 'little')
-  		width = int.from_bytes(f.read(4), 'little')
-  		height = int.from_bytes(f.read(4), 'little')
-  		if int.from_bytes(f.read(2), 'little') == 1: #planes must be 1
-  			depth = int.from_bytes(f.read(2), 'little')
-  			if depth == 24 and int.from_bytes(f.read(4), 'little') == 0:#compress method == uncompressed
-  				print("Image size:", width, "x", height)
-  				rowsize = (width * 3 + 3) & ~3
-  				if height < 0:
-  					height = -height
-  					flip = False
-  				else:
-  					flip = True
-  				w, h = width, height
- 				if w + aX > self._size[0]: w = self._size[0] - aX
-  				if h + aY > self._size[1]: h = self._size[1] - aY
-				self._setwindowloc((aX,aY),(w + aX - 1,h + aY - 1))
-  				for row in range(h):
-  					if flip:
-  						pos = offset + (height - 1 - row) * rowsize
-  					else:
-  						pos = offset + row * rowsize
-  					if f.tell() != pos:
-  						dummy = f.seek(pos)
-  					for col in range(w):
-  						bgr = f.read(3)
-  						self._pushcolor(TFTColor(bgr[2],bgr[1],bgr[0]))
-	
+    with open(filename, 'rb') as f :
+      if f.read(2) != b'BM':  #header
+        return
+      dummy = f.read(8) #file size(4), creator bytes(4)
+      offset = int.from_bytes(f.read(4), 'little')
+      hdrsize = int.from_bytes(f.read(4), 'little')
+      width = int.from_bytes(f.read(4), 'little')
+      height = int.from_bytes(f.read(4), 'little')
+      if int.from_bytes(f.read(2), 'little') != 1: #planes must be 1
+        return
+      depth = int.from_bytes(f.read(2), 'little')
+      if depth != 24 or int.from_bytes(f.read(4), 'little') != 0:#compress method == uncompressed
+        return
+      print("Image size:", width, "x", height)
+      rowsize = (width * 3 + 3) & ~3
+      if height & 0x80000000:
+        height = 0x100000000 - height   #Negative height, stored top to bottom.
+        pos = offset
+        step = rowsize
+      else:
+        pos = offset + (height - 1) * rowsize
+        step = -rowsize
+      w = min(width, self._size[0] - aX)
+      h = min(height, self._size[1] - aY)
+      if w <= 0 or h <= 0:
+        return
+
+      row = bytearray(rowsize)
+      if self._fb is not None :
+        #Convert straight into the frame buffer.
+        dst = self._fbmv
+        stride = self._size[0] * 2
+        d = aY * stride + aX * 2
+        for r in range(h):
+          if f.tell() != pos:
+            f.seek(pos)
+          f.readinto(row)
+          _bgr565(row, dst, d, w)
+          pos += step
+          d += stride
+        self._mark(aX, aY, w, h)
+        return
+
+      rows = max(1, _ROWBATCH // (w * 2))
+      batch = bytearray(rows * w * 2)
+      mv = memoryview(batch)
+      self._window(aX, aY, aX + w - 1, aY + h - 1)
+      n = 0
+      for r in range(h):
+        if f.tell() != pos:
+          f.seek(pos)
+        f.readinto(row)
+        _bgr565(row, batch, n * w * 2, w)
+        pos += step
+        n += 1
+        if n == rows or r == h - 1:
+          self._writedata(mv[:n * w * 2])
+          n = 0
+
+  def blit_file( self, filename, aX=0, aY=0, aFrame=0 ) :
+    '''Draw frame aFrame of a .565 image file with its top left corner at
+       aX, aY, clipped to the display.  The pixels are already in display
+       order so rows go from the file to the display without conversion.'''
+    with open(filename, 'rb') as f :
+      width, height, frames, flags = read565header(f)
+      if not 0 <= aFrame < frames :
+        raise ValueError("Frame out of range")
+      vx0 = max(0, -aX)
+      vx1 = min(width, self._size[0] - aX)
+      vy0 = max(0, -aY)
+      vy1 = min(height, self._size[1] - aY)
+      if vx1 <= vx0 or vy1 <= vy0 :
+        return
+      rowbytes = width * 2
+      n = (vx1 - vx0) * 2
+      rle = flags & _565RLE
+      if rle :
+        f.seek(_565HDR + aFrame * 4)
+        f.seek(int.from_bytes(f.read(4), 'little'))
+        need = width * 3 + 2            #Longest possible encoded row.
+        src = bytearray(need + 512)
+        sv = memoryview(src)
+        sn = f.readinto(src)
+        si = 0
+        first = 0
+      else :
+        f.seek(_565HDR + (aFrame * height + vy0) * rowbytes)
+        first = vy0
+      row = bytearray(rowbytes)
+      rv = memoryview(row)
+
+      if self._fb is not None :
+        dst = self._fbmv
+        stride = self._size[0] * 2
+        d = (aY + vy0) * stride + (aX + vx0) * 2
+        rows = 1
+      else :
+        rows = max(1, _ROWBATCH // n)
+        dst = memoryview(bytearray(rows * n))
+        stride = n
+        d = 0
+        self._window(aX + vx0, aY + vy0, aX + vx1 - 1, aY + vy1 - 1)
+      k = 0
+      for r in range(first, vy1) :
+        if rle :
+          if sn - si < need :
+            rem = sn - si
+            sv[0:rem] = sv[si:sn]
+            sn = rem + f.readinto(sv[rem:])
+            si = 0
+          si = _unrle(sv, si, rv, rowbytes)
+          if r < vy0 :
+            continue
+          dst[d:d + n] = rv[vx0 * 2:vx0 * 2 + n]
+        elif n == rowbytes :
+          f.readinto(dst[d:d + n])
+        else :
+          f.readinto(row)
+          dst[d:d + n] = rv[vx0 * 2:vx0 * 2 + n]
+        d += stride
+        k += 1
+        if self._fb is None and (k == rows or r == vy1 - 1) :
+          self._writedata(dst[:d])
+          d = 0
+          k = 0
+      if self._fb is not None :
+        self._mark(aX + vx0, aY + vy0, vx1 - vx0, vy1 - vy0)
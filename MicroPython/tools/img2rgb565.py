@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Convert images to the .565 format drawn by st7735.TFT.blit_file()
+#
+# Runs on your PC, not on Cya. Any image Pillow can open is accepted when
+# Pillow is installed (pip install pillow); without it only 24 bit
+# uncompressed .bmp files can be read.
+#
+# A .565 file holds one or more frames of the same size, already in the
+# big endian RGB565 order the display uses, so Cya can copy them straight
+# to the display. Use --rle to run length encode the rows, which makes
+# images with large areas of one color (like Cya's faces) much smaller.
+#
+# Examples:
+#   python img2rgb565.py face.png -o face.565
+#   python img2rgb565.py --rle blink1.bmp blink2.bmp blink3.bmp -o blink.565
+#   python img2rgb565.py --rle --frame-size 32x32 eyes_sheet.png -o eyes.565
+
+import argparse
+import struct
+import sys
+
+MAGIC = b'R565'
+VERSION = 1
+FLAG_RLE = 0x01
+HEADER = struct.Struct('<4sBBHHH')   # magic, version, flags, width, height, frames
+
+
+def rgb565(r, g, b):
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def read_bmp(path):
+    """ Read a 24 bit uncompressed .bmp. Returns (width, height, rows) where
+    rows is a list of lists of (r, g, b) tuples, top row first. """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[0:2] != b'BM':
+        raise ValueError("%s is not a .bmp file" % path)
+    offset, = struct.unpack_from('<I', data, 10)
+    width, height, planes, depth, compression = struct.unpack_from('<iiHHI', data, 18)
+    if planes != 1 or depth != 24 or compression != 0:
+        raise ValueError("%s is not a 24 bit uncompressed .bmp "
+                         "(install Pillow to read other formats)" % path)
+    rowsize = (width * 3 + 3) & ~3
+    rows = []
+    for row in range(abs(height)):
+        pos = offset + row * rowsize
+        rows.append([(data[p + 2], data[p + 1], data[p])
+                     for p in range(pos, pos + width * 3, 3)])
+    if height > 0:
+        rows.reverse()      # Stored bottom to top
+    return width, abs(height), rows
+
+
+def read_image(path):
+    """ Returns (width, height, rows) for any image Pillow can read. """
+    try:
+        from PIL import Image
+    except ImportError:
+        return read_bmp(path)
+    img = Image.open(path).convert('RGB')
+    width, height = img.size
+    pixels = list(img.getdata())
+    rows = [pixels[y * width:(y + 1) * width] for y in range(height)]
+    return width, height, rows
+
+
+def split_frames(width, height, rows, frame_w, frame_h):
+    """ Cut a sprite sheet into frames, left to right then top to bottom. """
+    if width % frame_w or height % frame_h:
+        raise ValueError("Sheet %dx%d is not a whole number of %dx%d frames"
+                         % (width, height, frame_w, frame_h))
+    frames = []
+    for top in range(0, height, frame_h):
+        for left in range(0, width, frame_w):
+            frames.append([row[left:left + frame_w] for row in rows[top:top + frame_h]])
+    return frames
+
+
+def encode_row(pixels, rle):
+    """ Encode one row of 565 values. The encoding matches st7735._unrle(). """
+    if not rle:
+        return b''.join(struct.pack('>H', p) for p in pixels)
+    out = bytearray()
+    literal = []
+
+    def flush():
+        while literal:
+            chunk = literal[:128]
+            del literal[:128]
+            out.append(len(chunk) - 1)
+            for p in chunk:
+                out.extend(struct.pack('>H', p))
+
+    i = 0
+    while i < len(pixels):
+        run = 1
+        while i + run < len(pixels) and run < 128 and pixels[i + run] == pixels[i]:
+            run += 1
+        if run >= 2:
+            flush()
+            out.append(0x80 | (run - 1))
+            out += struct.pack('>H', pixels[i])
+            i += run
+        else:
+            literal.append(pixels[i])
+            i += 1
+    flush()
+    return bytes(out)
+
+
+def encode(frames, width, height, rle):
+    flags = FLAG_RLE if rle else 0
+    body = [b''.join(encode_row([rgb565(*p) for p in row], rle) for row in frame)
+            for frame in frames]
+    out = bytearray(HEADER.pack(MAGIC, VERSION, flags, width, height, len(frames)))
+    if rle:
+        offset = len(out) + 4 * len(frames)
+        for data in body:
+            out += struct.pack('<I', offset)
+            offset += len(data)
+    for data in body:
+        out += data
+    return bytes(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert images to .565 files for Cya's display.")
+    parser.add_argument('images', nargs='+', help="input images, one frame each unless --frame-size is given")
+    parser.add_argument('-o', '--output', required=True, help="output .565 file")
+    parser.add_argument('--rle', action='store_true', help="run length encode the rows")
+    parser.add_argument('--frame-size', metavar='WxH', help="cut each input into frames of this size")
+    args = parser.parse_args(argv)
+
+    frames = []
+    size = None
+    for path in args.images:
+        width, height, rows = read_image(path)
+        if args.frame_size:
+            frame_w, frame_h = (int(v) for v in args.frame_size.lower().split('x'))
+            frames += split_frames(width, height, rows, frame_w, frame_h)
+            width, height = frame_w, frame_h
+        else:
+            frames.append(rows)
+        if size is None:
+            size = (width, height)
+        elif size != (width, height):
+            parser.error("%s is %dx%d but earlier frames are %dx%d" % ((path, width, height) + size))
+
+    data = encode(frames, size[0], size[1], args.rle)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    raw = size[0] * size[1] * 2 * len(frames)
+    print("%s: %d frame(s) of %dx%d, %d bytes (%d%% of raw)"
+          % (args.output, len(frames), size[0], size[1], len(data), 100 * len(data) // raw))
+
+
+if __name__ == '__main__':
+    sys.exit(main())